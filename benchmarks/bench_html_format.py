@@ -0,0 +1,167 @@
+"""Benchmark chatbot/html_format.py and the streaming reply path.
+
+Times format_message per call and over a simulated streaming session, reports
+throughput and allocations, and checks the output against the golden HTML
+files in benchmarks/golden/.
+
+Usage:
+    python -m benchmarks.bench_html_format [--repeat N] [--only NAME] [--update-golden]
+
+Exits with status 1 when an output differs from its golden file.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+from benchmarks.corpus import CORPUS
+from chatbot.html_format import StreamingFormatter, format_message
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), "golden")
+CHUNK_SIZE = 100  # generate_response yields roughly 100 characters at a time
+CHUNK_SPACING = 0.05  # Simulated seconds between two chunks from the LLM
+
+
+def chunks(text: str):
+    return [text[i:i + CHUNK_SIZE] for i in range(0, len(text), CHUNK_SIZE)]
+
+
+def best_of(fn, repeat: int) -> float:
+    """Return the fastest of `repeat` runs of `fn`, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def peak_allocations(fn) -> int:
+    """Return the peak traced memory of one run of `fn`, in bytes."""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def naive_session(text: str) -> None:
+    """Re-format the whole accumulated answer on every chunk, as before StreamingFormatter."""
+    accumulated = ""
+    for chunk in chunks(text):
+        accumulated += chunk
+        format_message(accumulated)
+
+
+def incremental_session(text: str) -> None:
+    formatter = StreamingFormatter()
+    for chunk in chunks(text):
+        formatter.feed(chunk)
+        formatter.render()
+
+
+def streaming_mismatches(text: str) -> int:
+    """Count chunk boundaries where the incremental render differs from format_message."""
+    formatter = StreamingFormatter()
+    accumulated = ""
+    mismatches = 0
+    for chunk in chunks(text):
+        accumulated += chunk
+        formatter.feed(chunk)
+        mismatches += formatter.render() != format_message(accumulated)
+    return mismatches
+
+
+class _FakeMessage:
+    """Stand-in for a telegram Message that only counts edits."""
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.edits = 0
+
+    async def edit_text(self, text, **kwargs):
+        self.edits += 1
+        return self
+
+
+def simulated_edits(text: str, chat_id: int) -> int:
+    """Return how many Telegram edits StreamingEditor makes for one streamed answer."""
+    from chatbot.streaming import StreamingEditor
+
+    clock = [0.0]
+    message = _FakeMessage(chat_id)
+
+    async def session():
+        editor = StreamingEditor(message, clock=lambda: clock[0])
+        for chunk in chunks(text):
+            clock[0] += CHUNK_SPACING
+            await editor.feed(chunk)
+        clock[0] += editor.interval
+        await editor.flush()
+
+    asyncio.run(session())
+    return message.edits
+
+
+def check_golden(name: str, text: str, update: bool) -> bool:
+    path = os.path.join(GOLDEN_DIR, f"{name}.html")
+    output = format_message(text)
+    formatter = StreamingFormatter()
+    for chunk in chunks(text):
+        formatter.feed(chunk)
+    if formatter.render() != output:
+        print(f"  {name}: streaming output differs from format_message")
+        return False
+
+    if update or not os.path.exists(path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(output)
+        return True
+    with open(path, encoding="utf-8") as f:
+        if f.read() != output:
+            print(f"  {name}: output differs from {os.path.relpath(path)}")
+            return False
+    return True
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20, help="runs per measurement, the best one is reported")
+    parser.add_argument("--only", help="benchmark a single corpus entry")
+    parser.add_argument("--update-golden", action="store_true", help="rewrite the golden HTML files")
+    args = parser.parse_args()
+
+    corpus = {args.only: CORPUS[args.only]} if args.only else CORPUS
+    print(f"{'answer':<18}{'chars':>7}{'chunks':>8}{'call µs':>10}{'MB/s':>8}"
+          f"{'naive ms':>10}{'incr ms':>9}{'speedup':>9}{'naive KB':>10}{'incr KB':>9}{'edits':>11}")
+
+    ok = True
+    for chat_id, (name, text) in enumerate(corpus.items(), start=1):
+        n_chunks = len(chunks(text))
+        per_call = best_of(lambda: format_message(text), args.repeat)
+        naive = best_of(lambda: naive_session(text), args.repeat)
+        incremental = best_of(lambda: incremental_session(text), args.repeat)
+        naive_peak = peak_allocations(lambda: naive_session(text))
+        incremental_peak = peak_allocations(lambda: incremental_session(text))
+        edits = simulated_edits(text, chat_id)
+        throughput = len(text.encode()) / per_call / 1e6
+
+        print(f"{name:<18}{len(text):>7}{n_chunks:>8}{per_call * 1e6:>10.1f}{throughput:>8.1f}"
+              f"{naive * 1e3:>10.2f}{incremental * 1e3:>9.2f}{naive / incremental:>8.1f}x"
+              f"{naive_peak / 1024:>10.1f}{incremental_peak / 1024:>9.1f}{f'{edits}/{n_chunks}':>11}")
+
+        mismatches = streaming_mismatches(text)
+        if mismatches:
+            print(f"  {name}: {mismatches} intermediate renders differ from format_message")
+            ok = False
+        ok = check_golden(name, text, args.update_golden) and ok
+
+    print("golden outputs: " + ("ok" if ok else "MISMATCH"))
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
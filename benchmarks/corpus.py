@@ -0,0 +1,78 @@
+# Realistic LLM answers used by the formatter benchmarks and golden checks.
+# Keep names stable, each one has a golden HTML file in benchmarks/golden/.
+
+SHORT_ANSWER = """The current water level at **Bassac** is *8.42 m*, which is below the warning level of 10.5 m.
+
+For live data visit [Flood Alert](https://floodalert.live/)."""
+
+LONG_LIST = "\n".join(
+    ["## Flood preparedness checklist", ""]
+    + [
+        f"* **Step {i}**: Check the *{item}* and keep `{item.replace(' ', '_')}` ready"
+        for i, item in enumerate(
+            [
+                "emergency kit", "drinking water", "first aid box", "phone charger",
+                "important documents", "evacuation route", "radio", "flashlight",
+                "medicine", "dry food", "livestock shelter", "sandbags",
+            ] * 4,
+            start=1,
+        )
+    ]
+    + ["", "Stay alert and follow the instructions of local authorities! 🚨"]
+)
+
+CODE_BLOCKS = """Here is how you can read the station data yourself:
+
+```python
+import requests
+
+response = requests.get("https://backend.floodalert.live/influx", params={"station": "bassac"})
+for point in response.json()["data"][-5:]:
+    print(point["_time"], point["_value"])
+```
+
+And the same request with curl:
+
+```bash
+curl "https://backend.floodalert.live/influx?station=bassac&range=1d&measurement=water_level"
+```
+
+Values are in **meters**, timestamps are in `UTC`. A value like `**not bold**` inside code stays as is:
+
+```
+* not a bullet
+**not bold**
+```
+"""
+
+LINKS_AND_MARKUP = """# Hydrometeorological update
+
+Rainfall over the last 24h was ~~12 mm~~ **18.4 mm** after correction, see [the rainfall dashboard](https://floodalert.live/rainfall) and [the river map](https://floodalert.live/map).
+
+__Important__: water flow at the *Chroy Changvar* gauge is rising at `0.12 m/h`.
+
+* Forecast peak: **9.1 m** on *Friday*
+* Confidence: moderate
+* Source: <model forecast & station data>
+
+### Notes
+Values marked with * are provisional."""
+
+KHMER = """## ស្ថានភាពទឹកជំនន់
+
+* **កម្រិតទឹក** នៅស្ថានីយ៍ *បាសាក់* គឺ `8.42 m`
+* ទឹកភ្លៀង: **18 mm** ក្នុងរយៈពេល ២៤ ម៉ោងចុងក្រោយ
+* លំហូរទឹក: កំពុងកើនឡើង
+
+សូមប្រុងប្រយ័ត្ន និងតាមដានព័ត៌មានថ្មីៗនៅ [Flood Alert](https://floodalert.live/) 🌊"""
+
+LONG_MIXED = "\n\n".join([LINKS_AND_MARKUP, LONG_LIST, CODE_BLOCKS, KHMER, SHORT_ANSWER] * 3)
+
+CORPUS = {
+    "short_answer": SHORT_ANSWER,
+    "long_list": LONG_LIST,
+    "code_blocks": CODE_BLOCKS,
+    "links_and_markup": LINKS_AND_MARKUP,
+    "khmer": KHMER,
+    "long_mixed": LONG_MIXED,
+}
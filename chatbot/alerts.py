@@ -0,0 +1,102 @@
+import json
+import os
+
+from chatbot.series import point_value, write_atomic
+
+# A level has to fall this far below a threshold before it can alert again
+ALERT_HYSTERESIS = float(os.getenv("ALERT_HYSTERESIS", "0.1"))
+# Rise per hour over RISE_WINDOW that triggers a rapid rise alert, per measurement
+RISE_RATES = {"water_level": float(os.getenv("ALERT_RISE_RATE", "0.05"))}
+RISE_WINDOW = "6h"
+# Alerts that are currently raised, kept across restarts so they aren't sent twice
+ALERT_STATE_PATH = os.getenv("ALERT_STATE_PATH", "alert_state.json")
+
+
+def _label(name: str) -> str:
+    return name.replace('_', ' ')
+
+
+class AlertEngine:
+    def __init__(self, analytics, hysteresis: float = ALERT_HYSTERESIS, rise_rates: dict = None,
+                 state_path: str = ALERT_STATE_PATH):
+        """Raise alerts when new points cross a threshold or a level rises quickly.
+
+        Each rule is either raised or clear and only a change of state produces a
+        message, so an alert is sent once and again only after it has cleared.
+        A threshold clears when the level drops `hysteresis` below it, a rapid
+        rise when the rate falls under half its trigger.
+
+        Args:
+            analytics (SeriesAnalytics): Provides the thresholds and rates of change.
+            hysteresis (float): Margin below a threshold before it clears.
+            rise_rates (dict): Measurement -> rise per hour that triggers an alert.
+            state_path (str): JSON file the raised alerts are stored in, None to keep them in memory.
+        """
+        self.analytics = analytics
+        self.hysteresis = hysteresis
+        self.rise_rates = RISE_RATES if rise_rates is None else rise_rates
+        self.state_path = state_path
+        self._raised = set()  # "station|measurement|rule"
+        self._dirty = False
+        if state_path:
+            self.load()
+
+    def load(self) -> None:
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                self._raised = set(json.load(f))
+        except (OSError, ValueError):
+            self._raised = set()
+
+    def save(self) -> None:
+        """Write the raised alerts to `state_path` if they changed."""
+        if self.state_path and self._dirty:
+            write_atomic(self.state_path, json.dumps(sorted(self._raised)))
+        self._dirty = False
+
+    def _transition(self, key: str, raised: bool) -> bool:
+        """Record the state of a rule and return whether it changed."""
+        if raised == (key in self._raised):
+            return False
+        if raised:
+            self._raised.add(key)
+        else:
+            self._raised.discard(key)
+        self._dirty = True
+        return True
+
+    def evaluate(self, station: str, measurement: str, points) -> list:
+        """Check the points merged into a series in this refresh and return the alert lines."""
+        values = [value for value in map(point_value, points or []) if value is not None]
+        if not values:
+            return []
+        current = values[-1]
+        lines = []
+
+        thresholds = self.analytics.thresholds(station, measurement)
+        for name, level in sorted(thresholds.items(), key=lambda item: item[1]):
+            key = f"{station}|{measurement}|{name}"
+            raised = key in self._raised
+            for value in values:
+                if value >= level:
+                    raised = True
+                elif value < level - self.hysteresis:
+                    raised = False
+            if self._transition(key, raised):
+                if raised:
+                    lines.append(f"🚨 {_label(measurement).capitalize()} reached the {name} level ({level}), now {current}.")
+                else:
+                    lines.append(f"✅ {_label(measurement).capitalize()} is back below the {name} level ({level}), now {current}.")
+
+        rise_rate = self.rise_rates.get(measurement)
+        stats = self.analytics.get(station, measurement)
+        if rise_rate is not None and stats is not None:
+            key = f"{station}|{measurement}|rise"
+            rate = stats["rate"][RISE_WINDOW]
+            raised = rate >= rise_rate or (key in self._raised and rate >= rise_rate / 2)
+            if self._transition(key, raised) and raised:
+                lines.append(f"⚠️ {_label(measurement).capitalize()} is rising fast: {rate:+.2f} per hour over the last {RISE_WINDOW}, now {current}.")
+        return lines
+
+    def render(self, station: str, lines: list) -> str:
+        return f"🌊 **Flood Alert for {_label(station).title()}**\n\n" + "\n".join(lines)
@@ -0,0 +1,167 @@
+import json
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+
+from chatbot.series import point_time, point_value
+
+# Windows statistics and rates of change are computed over, in hours
+STAT_WINDOWS = {"24h": 24, "7d": 24 * 7}
+RATE_WINDOWS = {"1h": 1, "6h": 6, "24h": 24}
+TREND_WINDOW = "6h"  # Rate used to project when a threshold will be reached
+
+# Levels per measurement, STATION_THRESHOLDS overrides them per station as JSON:
+# {"bassac": {"water_level": {"warning": 10.5, "danger": 12}}}
+DEFAULT_THRESHOLDS = {"water_level": {"warning": 10.5, "danger": 12.0}}
+
+
+def load_thresholds() -> dict:
+    """Return the per-station threshold overrides from STATION_THRESHOLDS."""
+    try:
+        return json.loads(os.getenv("STATION_THRESHOLDS") or "{}")
+    except ValueError as e:
+        print(f"Ignoring invalid STATION_THRESHOLDS: {e}")
+        return {}
+
+
+def _datetime(seconds):
+    return None if np.isnan(seconds) else datetime.fromtimestamp(float(seconds), tz=timezone.utc)
+
+
+class SeriesAnalytics:
+    def __init__(self, station_thresholds: dict = None):
+        """Statistics of every series in a RollingWindow, computed once per refresh.
+
+        The points of each series are kept as NumPy arrays that only grow by
+        the newly merged points. `refresh` lines all series up in one matrix
+        and computes everything in a single vectorised pass, `get` then
+        returns the cached result until the next refresh.
+
+        Args:
+            station_thresholds (dict): Station -> measurement -> threshold name -> level,
+                overriding DEFAULT_THRESHOLDS. Read from STATION_THRESHOLDS by default.
+        """
+        self.station_thresholds = load_thresholds() if station_thresholds is None else station_thresholds
+        self._arrays = {}  # (station, measurement) -> (times, values), unix seconds and floats, oldest first
+        self._stats = {}
+
+    def thresholds(self, station: str, measurement: str) -> dict:
+        return {
+            **DEFAULT_THRESHOLDS.get(measurement, {}),
+            **self.station_thresholds.get(station, {}).get(measurement, {}),
+        }
+
+    def get(self, station: str, measurement: str):
+        """Return the statistics of a series from the last refresh, or None."""
+        return self._stats.get((station, measurement))
+
+    def arrays(self, station: str, measurement: str):
+        """Return the (times, values) arrays of a series as of the last refresh, or None."""
+        return self._arrays.get((station, measurement))
+
+    def _update_arrays(self, window, station: str, measurement: str):
+        """Append the points merged since the last refresh and drop the ones that left the window."""
+        key = (station, measurement)
+        last = window.last_time(station, measurement)
+        if last is None:
+            self._arrays.pop(key, None)
+            return None
+
+        times, values = self._arrays.get(key, (np.empty(0), np.empty(0)))
+        since = times[-1] if times.size else -np.inf
+        if since == last.timestamp():
+            return times, values
+
+        new = []
+        for point in reversed(window.series(station, measurement)):
+            time = point_time(point).timestamp()
+            if time <= since:
+                break
+            value = point_value(point)
+            if value is not None:
+                new.append((time, value))
+        if new:
+            new_times, new_values = np.array(new[::-1]).T
+            times = np.concatenate([times, new_times])
+            values = np.concatenate([values, new_values])
+        start = np.searchsorted(times, last.timestamp() - window.window_seconds)
+        self._arrays[key] = (times[start:], values[start:])
+        return self._arrays[key]
+
+    def refresh(self, window, keys) -> dict:
+        """Recompute the statistics of the (station, measurement) series in `keys`."""
+        arrays = {}
+        for key in keys:
+            series = self._update_arrays(window, *key)
+            if series is not None and series[0].size:
+                arrays[key] = series
+        self._stats = self._compute(arrays) if arrays else {}
+        return self._stats
+
+    def _compute(self, arrays: dict) -> dict:
+        keys = list(arrays)
+        rows = np.arange(len(keys))
+        # One column more than the longest series, so there is always a pair of columns to compare
+        width = 1 + max(times.size for times, _ in arrays.values())
+
+        # Right-aligned so the newest point of every series is in the last column, NaN padded
+        times = np.full((len(keys), width), np.nan)
+        values = np.full((len(keys), width), np.nan)
+        for row, (series_times, series_values) in enumerate(arrays.values()):
+            times[row, width - series_times.size:] = series_times
+            values[row, width - series_values.size:] = series_values
+        valid = ~np.isnan(times)
+        last_time = times[:, -1]
+        current = values[:, -1]
+        age = last_time[:, None] - times
+
+        stats = {"min": {}, "max": {}, "mean": {}, "rate": {}}
+        for label, hours in STAT_WINDOWS.items():
+            in_window = np.where(age <= hours * 3600, values, np.nan)
+            stats["min"][label] = np.nanmin(in_window, axis=1)
+            stats["max"][label] = np.nanmax(in_window, axis=1)
+            stats["mean"][label] = np.nanmean(in_window, axis=1)
+        for label, hours in RATE_WINDOWS.items():
+            first = np.argmax(age <= hours * 3600, axis=1)
+            elapsed = last_time - times[rows, first]
+            change = current - values[rows, first]
+            stats["rate"][label] = np.divide(change * 3600, elapsed, out=np.zeros(len(keys)), where=elapsed > 0)
+        percentile = 100 * (valid & (values <= current[:, None])).sum(axis=1) / valid.sum(axis=1)
+
+        # Threshold crossings, one pass per threshold name over the rows that define it
+        crossings = {}
+        names = {name for station, measurement in keys for name in self.thresholds(station, measurement)}
+        for name in names:
+            levels = np.array([self.thresholds(*key).get(name, np.nan) for key in keys], dtype=float)
+            above = values >= levels[:, None]
+            rising = (values[:, :-1] < levels[:, None]) & above[:, 1:]
+            crossed = rising.any(axis=1)
+            last_crossing = width - 1 - np.argmax(rising[:, ::-1], axis=1)
+            crossed_at = np.where(crossed, times[rows, last_crossing], np.nan)
+            rate = stats["rate"][TREND_WINDOW]
+            eta = np.full(len(keys), np.nan)
+            approaching = (current < levels) & (rate > 0)
+            eta[approaching] = last_time[approaching] + (levels - current)[approaching] / rate[approaching] * 3600
+            crossings[name] = (levels, above[:, -1], crossed_at, eta)
+
+        results = {}
+        for row, key in enumerate(keys):
+            result = {
+                "time": _datetime(last_time[row]),
+                "value": float(current[row]),
+                "percentile": float(percentile[row]),
+                "thresholds": {},
+            }
+            for stat, by_window in stats.items():
+                result[stat] = {label: float(column[row]) for label, column in by_window.items()}
+            for name, (levels, above, crossed_at, eta) in crossings.items():
+                if not np.isnan(levels[row]):
+                    result["thresholds"][name] = {
+                        "level": float(levels[row]),
+                        "above": bool(above[row]),
+                        "crossed_at": _datetime(crossed_at[row]),
+                        "eta": _datetime(eta[row]),
+                    }
+            results[key] = result
+        return results
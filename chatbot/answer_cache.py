@@ -0,0 +1,63 @@
+import os
+import time
+import unicodedata
+from collections import OrderedDict
+
+# How long and how many LLM answers are reused for repeated questions
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "600"))  # Seconds
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "500"))
+
+
+def normalize_question(question: str) -> str:
+    """Reduce a question to a cache key: case, punctuation and spacing don't matter."""
+    text = unicodedata.normalize("NFKC", question).casefold()
+    text = "".join(" " if unicodedata.category(ch).startswith("P") else ch for ch in text)
+    return " ".join(text.split())
+
+
+class AnswerCache:
+    def __init__(self, ttl: float = ANSWER_CACHE_TTL, max_size: int = ANSWER_CACHE_SIZE, clock=time.monotonic):
+        """Answers to recent questions, valid for one version of the station snapshots.
+
+        `invalidate` is called whenever fetch_data produces new snapshots, which
+        drops every answer and bumps `version`. Answers generated from an older
+        version are not stored.
+
+        Args:
+            ttl (float): Seconds an answer is reused.
+            max_size (int): Answers kept before the least recently used is dropped.
+            clock: Monotonic clock, replaceable for simulations.
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+        self.version = 0
+        self._answers = OrderedDict()  # question -> (expires_at, answer), least recently used first
+
+    def get(self, question: str):
+        """Return the cached answer to `question`, or None."""
+        key = normalize_question(question)
+        entry = self._answers.get(key)
+        if entry is None:
+            return None
+        expires_at, answer = entry
+        if expires_at <= self.clock():
+            del self._answers[key]
+            return None
+        self._answers.move_to_end(key)
+        return answer
+
+    def put(self, question: str, answer: str, version: int) -> None:
+        """Store the answer to `question` generated from snapshot `version`."""
+        key = normalize_question(question)
+        if version != self.version or not key or not answer.strip():
+            return
+        self._answers[key] = (self.clock() + self.ttl, answer)
+        self._answers.move_to_end(key)
+        while len(self._answers) > self.max_size:
+            self._answers.popitem(last=False)
+
+    def invalidate(self) -> None:
+        """Forget every answer, the data they were based on has changed."""
+        self.version += 1
+        self._answers.clear()
@@ -0,0 +1,68 @@
+import asyncio
+import base64
+import json
+import time
+
+
+def jwt_expiry(token):
+    """Return the `exp` claim of a JWT as a unix timestamp, or None if it can't be read.
+
+    The signature is not verified, the claim is only used to schedule refreshes.
+    """
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return float(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+class TokenManager:
+    def __init__(self, login, token=None, refresh_margin=60):
+        """Cache an access token and refresh it through `login`.
+
+        Args:
+            login: Coroutine function returning a new access token, or None on failure.
+            token: Initial access token, e.g. from the environment.
+            refresh_margin (int): Seconds before `exp` at which the token is renewed.
+        """
+        self._login = login
+        self._refresh_margin = refresh_margin
+        self._refresh_task = None
+        self._set_token(token)
+
+    def _set_token(self, token):
+        self._token = token
+        self._expires_at = jwt_expiry(token)
+
+    def _needs_refresh(self) -> bool:
+        if not self._token:
+            return True
+        if self._expires_at is None:
+            # Not a readable JWT, rely on the backend rejecting it
+            return False
+        return time.time() >= self._expires_at - self._refresh_margin
+
+    async def get_token(self):
+        """Return a valid access token, refreshing ahead of expiry when needed."""
+        if self._needs_refresh():
+            return await self.refresh()
+        return self._token
+
+    async def refresh(self, rejected=None):
+        """Log in again and return the new token.
+
+        Concurrent callers share a single login. When `rejected` is given and the
+        cached token has already moved on, the cached token is returned as is.
+        """
+        if rejected is not None and self._token and self._token != rejected:
+            return self._token
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._login_and_store())
+        return await asyncio.shield(self._refresh_task)
+
+    async def _login_and_store(self):
+        token = await self._login()
+        if token:
+            self._set_token(token)
+        return token
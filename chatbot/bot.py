@@ -18,24 +18,49 @@ from chatbot.handlers import (
     new_session,
     broadcast_daily,
     fetch_data,
+    history,
+    restore_state,
+    resume_broadcast,
+    series_store,
+    chart_cache,
+    prune_conversations,
+    warm_conversations,
+    user_manager,
     SYSTEM_PROMPT_SP,
     CANCEL_SP
 )
 from chatbot.filters import AuthFilter, MessageFilter
+from chatbot.http_client import close_client
 from dotenv import load_dotenv
 from datetime import timedelta
 load_dotenv(override=True)
 
 
+async def startup(app: Application) -> None:
+    """Load the last snapshots and the stored history before the first refresh runs."""
+    await restore_state()
+    await resume_broadcast(app.job_queue)
+
+
+async def shutdown(_: Application) -> None:
+    """Release the HTTP pool, the chart processes and the database connections."""
+    await close_client()
+    chart_cache.close()
+    await user_manager.close()
+    await series_store.close()
+
+
 def telegram_bot():
-    app = Application.builder().token(os.getenv("BOT_TOKEN")).build()
+    app = Application.builder().token(os.getenv("BOT_TOKEN")).post_init(startup).post_shutdown(shutdown).build()
 
     app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("history", history))
     app.add_handler(MessageHandler(MessageFilter, message_handler))
     app.add_handler(CallbackQueryHandler(button_callback))
     app.job_queue.run_daily(broadcast_daily, time(hour=7, minute=0, second=0, tzinfo=timezone('Asia/Phnom_Penh')))
     app.job_queue.run_repeating(fetch_data, interval=300, first=0)
-    app.job_queue.run_once(fetch_data, when=0)
+    app.job_queue.run_once(warm_conversations, when=0)
+    app.job_queue.run_repeating(prune_conversations, interval=60, first=60)
 
     # Run the bot until the user presses Ctrl-C
     app.run_polling(allowed_updates=Update.ALL_TYPES)
\ No newline at end of file
@@ -0,0 +1,211 @@
+import asyncio
+import json
+import os
+import time
+
+from telegram.error import Forbidden, RetryAfter, TelegramError
+
+from chatbot.series import write_atomic
+
+# Telegram allows roughly 30 messages per second per bot, stay a little below it
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", "8"))
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+BROADCAST_CHECKPOINT_PATH = os.getenv("BROADCAST_CHECKPOINT_PATH", "broadcast_checkpoint.json")
+CHECKPOINT_INTERVAL = 1.0  # Seconds between checkpoint writes while a broadcast runs
+
+
+def retry_after_seconds(retry_after) -> float:
+    """Return RetryAfter.retry_after in seconds, whether it is an int or a timedelta."""
+    if hasattr(retry_after, "total_seconds"):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        """Allow `rate` acquisitions per second with bursts of up to `capacity`."""
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float) -> None:
+        """Stop handing out tokens for `seconds`, e.g. after a RetryAfter."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self) -> None:
+        """Wait until a token is available and take it."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class BroadcastEngine:
+    def __init__(self, bot, rate=BROADCAST_RATE, workers=BROADCAST_WORKERS,
+                 checkpoint_path=BROADCAST_CHECKPOINT_PATH, max_retries=BROADCAST_MAX_RETRIES, bucket=None):
+        """Send messages to many chats within Telegram's rate limits.
+
+        Args:
+            bot: The telegram Bot used to send messages.
+            rate (float): Messages per second shared by all workers.
+            workers (int): Number of chats served concurrently.
+            checkpoint_path (str): JSON file recording progress, None to disable resuming.
+            max_retries (int): Attempts per message on errors other than RetryAfter.
+            bucket (TokenBucket): Rate limit shared with other engines, overrides `rate`.
+        """
+        self.bot = bot
+        self.bucket = bucket if bucket is not None else TokenBucket(rate)
+        self.workers = workers
+        self.checkpoint_path = checkpoint_path
+        self.max_retries = max_retries
+        self._progress = {}
+        self._dirty = False
+
+    def _read_checkpoint(self) -> dict:
+        if not self.checkpoint_path:
+            return {}
+        try:
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return checkpoint if isinstance(checkpoint, dict) else {}
+
+    def _load_checkpoint(self, broadcast_id: str) -> dict:
+        """Return the messages already sent per chat for `broadcast_id`."""
+        checkpoint = self._read_checkpoint()
+        if checkpoint.get("broadcast_id") != broadcast_id:
+            return {}
+        return {int(chat_id): sent for chat_id, sent in checkpoint.get("sent", {}).items()}
+
+    async def _save_checkpoint(self, broadcast_id: str) -> None:
+        if not self.checkpoint_path or not self._dirty:
+            return
+        self._dirty = False
+        payload = json.dumps({"broadcast_id": broadcast_id, "sent": self._progress})
+        await asyncio.to_thread(write_atomic, self.checkpoint_path, payload)
+
+    async def _send(self, chat_id: int, text: str, **kwargs) -> bool:
+        """Send one message, waiting out flood limits. Returns False if it was given up."""
+        attempts = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+                return True
+            except RetryAfter as e:
+                # Flood control applies to the whole bot, hold every worker
+                self.bucket.pause(retry_after_seconds(e.retry_after))
+            except Forbidden:
+                raise
+            except TelegramError as e:
+                attempts += 1
+                if attempts >= self.max_retries:
+                    print(f"Error sending message to {chat_id}: {e}")
+                    return False
+                await asyncio.sleep(2 ** attempts)
+
+    async def _worker(self, queue: asyncio.Queue, jobs: dict, stats: dict, kwargs: dict) -> None:
+        while True:
+            try:
+                chat_id = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            messages = jobs[chat_id]
+            # Messages of one chat go out in order from a single worker
+            for index in range(self._progress.get(chat_id, 0), len(messages)):
+                try:
+                    sent = await self._send(chat_id, messages[index], **kwargs)
+                except Forbidden as e:
+                    print(f"Skipping {chat_id}, bot was blocked: {e}")
+                    stats["failed"] += len(messages) - index
+                    self._progress[chat_id] = len(messages)
+                    self._dirty = True
+                    break
+                stats["sent" if sent else "failed"] += 1
+                self._progress[chat_id] = index + 1
+                self._dirty = True
+
+    async def run(self, broadcast_id: str, jobs: dict, **kwargs) -> dict:
+        """Deliver `jobs` (chat_id -> ordered list of texts) and return send statistics.
+
+        Progress is checkpointed under `broadcast_id`, running the same id again after
+        a restart only sends what had not been recorded as sent yet.
+        """
+        self._progress = self._load_checkpoint(broadcast_id)
+        self._dirty = False
+        stats = {"sent": 0, "failed": 0, "skipped": sum(min(n, len(jobs.get(c, []))) for c, n in self._progress.items())}
+
+        queue = asyncio.Queue()
+        for chat_id, messages in jobs.items():
+            if self._progress.get(chat_id, 0) < len(messages):
+                queue.put_nowait(chat_id)
+
+        workers = [
+            asyncio.create_task(self._worker(queue, jobs, stats, kwargs))
+            for _ in range(min(self.workers, queue.qsize()))
+        ]
+        try:
+            while not all(worker.done() for worker in workers):
+                await asyncio.wait(workers, timeout=CHECKPOINT_INTERVAL)
+                await self._save_checkpoint(broadcast_id)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            self._dirty = True
+            await self._save_checkpoint(broadcast_id)
+        for worker in workers:
+            if not worker.cancelled() and worker.exception() is not None:
+                print(f"Broadcast worker failed: {worker.exception()}")
+        return stats
+
+    def _resume_cursor(self, broadcast_id: str):
+        """Return the cursor of the batch `broadcast_id` was at when its checkpoint was written."""
+        batch_id = self._read_checkpoint().get("broadcast_id", "")
+        prefix = f"{broadcast_id}@"
+        return json.loads(batch_id[len(prefix):]) if batch_id.startswith(prefix) else None
+
+    def finished(self, broadcast_id: str) -> bool:
+        """Return whether every batch of `broadcast_id` has been delivered."""
+        checkpoint = self._read_checkpoint()
+        return checkpoint.get("broadcast_id") == broadcast_id and checkpoint.get("finished", False)
+
+    def unfinished(self, broadcast_id: str) -> bool:
+        """Return whether `broadcast_id` stopped before its last batch, e.g. because of a restart."""
+        return self._resume_cursor(broadcast_id) is not None
+
+    async def run_batches(self, broadcast_id: str, batches, **kwargs) -> dict:
+        """Deliver jobs produced one batch at a time, so memory doesn't grow with the audience.
+
+        `batches(cursor)` is an async generator yielding `(cursor, jobs)` pairs, where
+        `cursor` is a JSON-serialisable position the generator can restart from and
+        `jobs` is shaped like `run`'s. After a restart the generator is called with
+        the cursor of the batch that was in progress, which resumes where it stopped.
+        Once the last batch is delivered the broadcast is recorded as finished and
+        running it again sends nothing.
+        """
+        stats = {"sent": 0, "failed": 0, "skipped": 0}
+        if self.finished(broadcast_id):
+            print(f"Broadcast {broadcast_id} already finished")
+            return stats
+        async for cursor, jobs in batches(self._resume_cursor(broadcast_id)):
+            batch_stats = await self.run(f"{broadcast_id}@{json.dumps(cursor)}", jobs, **kwargs)
+            for key, count in batch_stats.items():
+                stats[key] += count
+        if self.checkpoint_path:
+            payload = json.dumps({"broadcast_id": broadcast_id, "finished": True})
+            await asyncio.to_thread(write_atomic, self.checkpoint_path, payload)
+        return stats
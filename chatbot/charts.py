@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+# Processes drawing charts, kept out of the bot's process so rendering never blocks it
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "2"))
+
+_PANELS = (
+    ("water_level", "Water level", "tab:blue"),
+    ("rainfall", "Rainfall", "tab:green"),
+    ("water_flow", "Water flow", "tab:purple"),
+)
+
+
+def _dates(times):
+    return [datetime.fromtimestamp(float(time), tz=timezone.utc) for time in times]
+
+
+def render_chart(station: str, series: dict, forecast: list, thresholds: dict) -> bytes:
+    """Draw the series and the water level forecast of a station and return the PNG.
+
+    Runs in a worker process, so it only takes plain data.
+
+    Args:
+        station (str): Station name used in the title.
+        series (dict): Measurement -> (times, values), unix seconds and floats.
+        forecast (list): (unix seconds, value) pairs of the water level forecast.
+        thresholds (dict): Threshold name -> water level drawn as a horizontal line.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.dates as mdates
+    import matplotlib.pyplot as plt
+
+    fig, axes = plt.subplots(len(_PANELS), 1, figsize=(9, 8), sharex=True)
+    try:
+        for ax, (measurement, label, color) in zip(axes, _PANELS):
+            times, values = series.get(measurement, ((), ()))
+            if measurement == "rainfall" and len(times):
+                ax.bar(_dates(times), values, width=1 / 24, color=color)
+            elif len(times):
+                ax.plot(_dates(times), values, color=color, linewidth=1.2)
+            if measurement == "water_level":
+                if forecast:
+                    forecast_times, forecast_values = zip(*forecast)
+                    ax.plot(_dates(forecast_times), forecast_values, color=color, linestyle="--", label="Forecast")
+                for name, level in thresholds.items():
+                    ax.axhline(level, color="tab:red", linewidth=0.8, linestyle=":", label=f"{name.title()} ({level})")
+                if forecast or thresholds:
+                    ax.legend(loc="upper left", fontsize="small")
+            if not len(times):
+                ax.text(0.5, 0.5, "No data", transform=ax.transAxes, ha="center", va="center", color="grey")
+            ax.set_ylabel(label)
+            ax.grid(True, alpha=0.3)
+        axes[-1].xaxis.set_major_formatter(mdates.DateFormatter("%d %b"))
+        fig.suptitle(f"{station.replace('_', ' ').title()}: last 15 days and forecast")
+        fig.tight_layout()
+
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format="png", dpi=100)
+        return buffer.getvalue()
+    finally:
+        plt.close(fig)
+
+
+class ChartCache:
+    def __init__(self, workers: int = CHART_WORKERS):
+        """PNG charts of every station, rendered once per refresh in a process pool.
+
+        Args:
+            workers (int): Processes rendering charts at the same time.
+        """
+        self.workers = workers
+        self._charts = {}  # station -> (sha1 of the PNG, PNG bytes)
+        self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawned rather than forked, the bot's process runs several threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def get(self, station: str):
+        """Return the (digest, PNG bytes) chart of a station from the last refresh, or None."""
+        return self._charts.get(station)
+
+    async def refresh(self, charts: dict) -> None:
+        """Render the charts of `charts` (station -> render_chart arguments) and replace the cached ones."""
+        loop = asyncio.get_running_loop()
+        stations = list(charts)
+        results = await asyncio.gather(
+            *(loop.run_in_executor(self._get_executor(), render_chart, station, *charts[station]) for station in stations),
+            return_exceptions=True,
+        )
+        for station, result in zip(stations, results):
+            if isinstance(result, Exception):
+                print(f"Error rendering the chart of {station}: {result}")
+            else:
+                self._charts[station] = (hashlib.sha1(result).hexdigest(), result)
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,153 @@
+import asyncio
+import os
+import random
+import time
+from datetime import datetime, timezone
+
+# Consecutive failures that open a breaker, and seconds it stays open before a trial call
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "60"))
+# Extra attempts per call while closed, spaced by jittered exponential backoff
+CIRCUIT_RETRIES = int(os.getenv("CIRCUIT_RETRIES", "2"))
+CIRCUIT_RETRY_DELAY = float(os.getenv("CIRCUIT_RETRY_DELAY", "0.5"))
+CIRCUIT_MAX_RETRY_DELAY = 5.0
+# Seconds all attempts of one call may take together, keep it below REFRESH_DEADLINE
+# so a hanging endpoint fails here, and counts towards opening, before the refresh gives up
+CIRCUIT_CALL_BUDGET = float(os.getenv("CIRCUIT_CALL_BUDGET", "25"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose breaker is open."""
+
+
+def mark_stale(value, fetched_at: float):
+    """Return a last good value flagged as stale, with the time it was fetched."""
+    fetched = datetime.fromtimestamp(fetched_at, tz=timezone.utc).isoformat()
+    if isinstance(value, dict):
+        return {**value, "stale": True, "fetched_at": fetched}
+    return {"data": value, "stale": True, "fetched_at": fetched}
+
+
+def stale_since(value):
+    """Return the unix time a value marked by mark_stale was fetched, None if it is fresh."""
+    if isinstance(value, dict) and value.get("stale"):
+        return datetime.fromisoformat(value["fetched_at"]).timestamp()
+    return None
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT, retries: int = CIRCUIT_RETRIES,
+                 retry_delay: float = CIRCUIT_RETRY_DELAY, budget: float = CIRCUIT_CALL_BUDGET,
+                 clock=time.monotonic):
+        """Stop calling an upstream endpoint while it keeps failing.
+
+        After `failure_threshold` consecutive failed calls the breaker opens and
+        calls fail immediately. After `reset_timeout` seconds one trial call is
+        let through (half-open): success closes the breaker, failure opens it again.
+        A call that runs out of `budget` or is cancelled counts as a failure.
+        The last good value of every key is kept and returned, marked stale,
+        when a call fails or is refused.
+
+        Args:
+            name (str): Endpoint name used in log messages.
+            failure_threshold (int): Consecutive failures that open the breaker.
+            reset_timeout (float): Seconds the breaker stays open.
+            retries (int): Extra attempts per call while the breaker is closed.
+            retry_delay (float): Base delay of the jittered exponential backoff.
+            budget (float): Seconds all attempts of a call may take together.
+            clock: Monotonic clock, replaceable for simulations.
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.budget = budget
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._last_good = {}  # key -> (value, unix time it was fetched)
+
+    def _allow(self) -> bool:
+        """Return whether a call may go through, moving from open to half-open when due."""
+        if self.state == OPEN and self.clock() - self._opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+        if self.state == HALF_OPEN:
+            if self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+        return self.state == CLOSED
+
+    def _record_success(self) -> None:
+        if self.state != CLOSED:
+            print(f"Circuit {self.name} closed")
+        self.state = CLOSED
+        self.failures = 0
+
+    def _record_failure(self) -> None:
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                print(f"Circuit {self.name} opened after {self.failures} failures")
+            self.state = OPEN
+            self._opened_at = self.clock()
+
+    def last_good(self, key):
+        """Return the last good value of `key` marked as stale, or None."""
+        if key not in self._last_good:
+            return None
+        return mark_stale(*self._last_good[key])
+
+    async def call(self, key, fn, *args, **kwargs):
+        """Await `fn(*args, **kwargs)` through the breaker.
+
+        Falls back to the last good value of `key`, marked stale, when the call
+        fails or the breaker is open. Raises the error (CircuitOpenError if the
+        call was refused) when there is no such value.
+        """
+        if not self._allow():
+            stale = self.last_good(key)
+            if stale is not None:
+                return stale
+            raise CircuitOpenError(f"{self.name} is unavailable, retrying in {self.reset_timeout:.0f}s at most")
+
+        trial = self.state == HALF_OPEN
+        attempts = 1 if trial else 1 + self.retries
+        try:
+            async with asyncio.timeout(self.budget):
+                for attempt in range(attempts):
+                    try:
+                        value = await fn(*args, **kwargs)
+                    except Exception as e:
+                        error = e
+                        if attempt + 1 < attempts:
+                            # Full jitter keeps retries of concurrent callers from arriving together
+                            await asyncio.sleep(random.uniform(0, min(CIRCUIT_MAX_RETRY_DELAY, self.retry_delay * 2 ** attempt)))
+                        continue
+                    self._record_success()
+                    self._last_good[key] = (value, time.time())
+                    return value
+        except TimeoutError:
+            error = TimeoutError(f"no answer within {self.budget:g}s")
+        except asyncio.CancelledError:
+            # The caller gave up waiting, as far as the breaker is concerned the endpoint hung
+            self._record_failure()
+            raise
+        finally:
+            if trial:
+                self._trial_running = False
+
+        self._record_failure()
+        stale = self.last_good(key)
+        if stale is not None:
+            print(f"Serving stale {self.name} data for {key}: {error}")
+            return stale
+        raise error
@@ -0,0 +1,93 @@
+import os
+from datetime import datetime, timezone
+
+from chatbot.analytics import TREND_WINDOW
+from chatbot.series import point_time, point_value
+
+# Upper bound on the size of the data summary sent with every LLM prompt
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "400"))
+CHARS_PER_TOKEN = 4  # Rough average for English text and numbers
+
+_FORECAST_KEYS = ("data", "forecast", "predictions", "prediction")
+
+
+def estimate_tokens(text: str) -> int:
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _forecast_points(forecast):
+    """Find the predicted points in a predict_water_level response."""
+    if isinstance(forecast, list):
+        return forecast
+    if isinstance(forecast, dict):
+        for key in _FORECAST_KEYS:
+            if isinstance(forecast.get(key), (list, dict)):
+                return _forecast_points(forecast[key])
+        # A mapping of timestamps to values
+        return [[time, value] for time, value in forecast.items()]
+    return []
+
+
+def _fmt(value: float) -> str:
+    return f"{value:.2f}".rstrip("0").rstrip(".")
+
+
+def _fmt_time(time: datetime) -> str:
+    return time.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
+
+
+def summarize_series(stats, detail: int = 3) -> str:
+    """Describe a series in one line from its SeriesAnalytics statistics.
+
+    `detail` drops the trend (below 3) and the 7d range (below 2).
+    """
+    if not stats:
+        return "unavailable"
+    parts = [f"now {_fmt(stats['value'])} ({_fmt_time(stats['time'])})"]
+    for label, level in (("24h", 1), ("7d", 2)):
+        if detail >= level:
+            parts.append(f"{label} {_fmt(stats['min'][label])}-{_fmt(stats['max'][label])}")
+    if detail >= 3:
+        rate = stats["rate"][TREND_WINDOW]
+        direction = "rising" if rate > 0 else "falling" if rate < 0 else "steady"
+        parts.append(f"trend {direction} {rate:+.3f}/h")
+    return ", ".join(parts)
+
+
+def forecast_values(forecast) -> list:
+    """Return the (time, value) pairs of a predict_water_level response, oldest first."""
+    pairs = [(point_time(point), point_value(point)) for point in _forecast_points(forecast)]
+    return sorted((pair for pair in pairs if pair[0] is not None and pair[1] is not None), key=lambda pair: pair[0])
+
+
+def summarize_forecast(forecast) -> str:
+    """Describe a forecast by its peak value and when it is expected."""
+    values = forecast_values(forecast)
+    if not values:
+        return "unavailable"
+    peak_time, peak = max(values, key=lambda pair: pair[1])
+    return f"peak {_fmt(peak)} at {_fmt_time(peak_time)}"
+
+
+def build_context(forecasts: dict, series, measurements, budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+    """Summarize the latest data of every station for the LLM within `budget` tokens.
+
+    Details are dropped until the summary fits, as a last resort it is cut off.
+
+    Args:
+        forecasts (dict): Station -> its forecast, as returned by predict_water_level.
+        series: Function returning the statistics of a (station, measurement) series.
+        measurements: Measurements summarized for every station.
+        budget (int): Maximum estimated tokens of the summary.
+    """
+    for detail in (3, 2, 1):
+        lines = []
+        for station, forecast in forecasts.items():
+            lines.append(f"Station {station}:")
+            for measurement in measurements:
+                lines.append(f"- {measurement.replace('_', ' ')}: {summarize_series(series(station, measurement), detail)}")
+            lines.append(f"- water level forecast: {summarize_forecast(forecast)}")
+        context = "\n".join(lines)
+        if estimate_tokens(context) <= budget:
+            return context
+    return context[:budget * CHARS_PER_TOKEN]
@@ -1,3 +1,9 @@
+import asyncio
+import json
+import os
+import time
+from datetime import datetime
+from pytz import timezone
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import (
     ContextTypes,
@@ -7,15 +13,44 @@ from telegram.ext import (
 )
 from telegram.error import NetworkError, BadRequest
 from telegram.constants import ChatAction, ParseMode
+from chatbot.analytics import SeriesAnalytics
+from chatbot.answer_cache import AnswerCache
+from chatbot.alerts import AlertEngine
+from chatbot.broadcast import BROADCAST_RATE, BroadcastEngine, TokenBucket
+from chatbot.charts import ChartCache
+from chatbot.circuit import stale_since
+from chatbot.context import build_context, forecast_values
 from chatbot.html_format import format_message
-from chatbot.huggingchat import chatbot, generate_response
-from chatbot.queries import fetch_measurement, fetch_metadata, predict_water_level
+from chatbot.huggingchat import ConversationPool, chat_pool, generate_response
+from chatbot.image_cache import ImageCache, image_url, image_version, latest_image
+from chatbot.queries import (
+    INFLUX_BATCH,
+    MEASUREMENTS,
+    fetch_image_data,
+    fetch_measurement,
+    fetch_measurements,
+    fetch_metadata,
+    predict_water_level,
+)
+from chatbot.series import RollingWindow, write_atomic
+from chatbot.streaming import StreamingEditor
+from chatbot.timeseries import SeriesStore
 from chatbot.user import UserManager
 
 # Bot Configuration
 SYSTEM_PROMPT_SP = 1
 CANCEL_SP = 2
 DEFAULT_MODEL_INDEX = 0
+REFRESH_DEADLINE = float(os.getenv("REFRESH_DEADLINE", "30"))  # Seconds a refresh cycle may wait on upstream calls
+BROADCAST_TZ = timezone('Asia/Phnom_Penh')
+REFRESH_CONCURRENCY = int(os.getenv("REFRESH_CONCURRENCY", "4"))  # Stations refreshed at the same time
+IMAGE_RANGE = "1d"  # Range searched for the latest station image
+STATIC_IMAGES = {
+    "bassac": 'https://www.khmertimeskh.com/wp-content/uploads/2024/08/Phnom-Penh-condos-riverside-living.jpg'
+}
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", "snapshot.json")  # Latest snapshots, loaded at startup
+SNAPSHOT_STALE_AFTER = float(os.getenv("SNAPSHOT_STALE_AFTER", "900"))  # Seconds after which a snapshot's age is shown
+INCREMENTAL_FETCH = os.getenv("INCREMENTAL_FETCH", "true").lower() == "true"  # Only request points newer than the last seen
 FIXED_SYSTEM_PROMPT = f"""
     You are a chatbot called Flood Alert, and your response will only be about Flood and Hydrometeorological Monitoring.
 
@@ -24,17 +59,51 @@ FIXED_SYSTEM_PROMPT = f"""
 
 # Initialize UserManager
 user_manager = UserManager()
+# Rolling 15-day window of every fetched series
+series_window = RollingWindow(path=os.getenv("SERIES_CACHE_PATH"))
+# Local history of every series with hourly and daily rollups
+series_store = SeriesStore()
+# Statistics of every series in the window, recomputed once per refresh
+analytics = SeriesAnalytics()
+# Telegram file_ids of station images that were already uploaded
+image_cache = ImageCache()
+# Newest image record of each station, fetched once per refresh by fetch_data
+latest_images = {}
+# Charts of every station, rendered once per refresh
+chart_cache = ChartCache()
+# Threshold and rapid rise alerts raised from newly fetched points
+alert_engine = AlertEngine(analytics)
+# Daily reports and alerts share one Telegram rate limit
+send_bucket = TokenBucket(BROADCAST_RATE)
+# Latest snapshot per station, keyed like the subscriptions
+context_data = {}
+# Fields of a station snapshot, each one is refreshed and timed on its own
+SNAPSHOT_FIELDS = ("water_level_forecast", "water_level_info", "rainfall_info", "water_flow_info")
+# Unix time each field of a station's snapshot was fetched, same keys as context_data
+snapshot_times = {}
+# Compact summary of the snapshots sent with every LLM prompt, rebuilt by fetch_data
+llm_context = ""
+# One LLM conversation per chat, handed out from pre-warmed ones
+conversations = ConversationPool(chat_pool, DEFAULT_MODEL_INDEX, FIXED_SYSTEM_PROMPT)
+# Answers to repeated questions, dropped whenever the snapshots change
+answer_cache = AnswerCache()
+
+
+def station_key(station: str) -> str:
+    """Return the key a station is stored under in subscriptions and snapshots."""
+    return station.replace(' ', '_')
 
 
 async def start(update: Update, _: ContextTypes.DEFAULT_TYPE) -> None:
     """Send a message with buttons when the command /start is issued.""" 
     user = update.effective_user
-    user_manager.save_user(user.id, user.first_name, user.username, update.effective_chat.id)
+    await user_manager.save_user(user.id, user.first_name, user.username, update.effective_chat.id)
     
     # Define buttons
     keyboard = [
         [InlineKeyboardButton("Start a new chat session", callback_data='new_session')],
         [InlineKeyboardButton("Fetch latest image of the location", callback_data='image')],
+        [InlineKeyboardButton("View the water level chart", callback_data='chart')],
         [InlineKeyboardButton("Subscribe to daily flood alerts", callback_data='subscribe')],
         [InlineKeyboardButton("Unsubscribe from daily flood alerts", callback_data='unsubscribe')]
     ]
@@ -61,6 +130,11 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await new_session(query, context)
     elif query.data == 'image':
         await image_station_selection(query)
+    elif query.data == 'chart':
+        await chart_station_selection(query)
+    elif query.data.startswith("chart_"):
+        station = query.data[len("chart_"):]
+        await send_station_chart(query, context, station)
     elif query.data.startswith("station_"):
         station = query.data[len("station_"):]
         await send_location_image(query, context, station)
@@ -74,7 +148,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def image_station_selection(query, is_unsubscribe: bool = False) -> None:
     """Prompt the user to select a station for subscription or unsubscription.""" 
-    keyboard = [[InlineKeyboardButton(station, callback_data=f"station_{station}")] for station in fetch_metadata()]
+    keyboard = [[InlineKeyboardButton(station, callback_data=f"station_{station}")] for station in await fetch_metadata()]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     await query.message.reply_text(  # Send a new message instead of editing the existing one
@@ -82,31 +156,84 @@ async def image_station_selection(query, is_unsubscribe: bool = False) -> None:
         reply_markup=reply_markup
     )
 
+def _station_image(location: str):
+    """Return the URL and version of the station's latest image, or (None, None)."""
+    record = latest_images.get(location)
+    if image_url(record) is None:
+        # No image from the backend, fall back to the static one
+        record = STATIC_IMAGES.get(location)
+    url = image_url(record)
+    return (url, image_version(record)) if url else (None, None)
+
 async def send_location_image(query, context: ContextTypes.DEFAULT_TYPE, location: str) -> None:
     """Send the latest image of the selected location to the user.""" 
-    location_images = {
-        "bassac": 'https://www.khmertimeskh.com/wp-content/uploads/2024/08/Phnom-Penh-condos-riverside-living.jpg'
-    }
-
-    image_path = location_images.get(location, None)
+    image_path, version = _station_image(location)
     print(image_path)
     if image_path:
         await query.edit_message_text(  # Edit the original message instead of sending a new one
             text=f"Location: {location.replace('_', ' ').title()}",
             reply_markup=None  # Remove the keyboard
         )
-        await context.bot.send_photo(
+        photo_kwargs = dict(
             chat_id=query.message.chat.id,
-            photo=image_path,
             caption=f"Latest image of {location.replace('_', ' ').title()}",
             reply_to_message_id=query.message.message_id  # Link the photo to the original message
         )
+        # Reuse the upload of this exact image so Telegram doesn't download it again
+        file_id = image_cache.get(location, version)
+        if file_id:
+            try:
+                await context.bot.send_photo(photo=file_id, **photo_kwargs)
+                return
+            except BadRequest as e:
+                print(f"Cached image of {location} rejected, uploading it again: {e}")
+                image_cache.discard(location)
+        message = await context.bot.send_photo(photo=image_path, **photo_kwargs)
+        if message.photo:
+            image_cache.put(location, version, message.photo[-1].file_id)
     else:
         await query.edit_message_text("Sorry, no image available for this location.")
 
+async def chart_station_selection(query) -> None:
+    """Prompt the user to select a station to see the chart of."""
+    keyboard = [[InlineKeyboardButton(station, callback_data=f"chart_{station}")] for station in await fetch_metadata()]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+
+    await query.message.reply_text(
+        f"Please select a station to view the chart of:",
+        reply_markup=reply_markup
+    )
+
+async def send_station_chart(query, context: ContextTypes.DEFAULT_TYPE, station: str) -> None:
+    """Send the chart rendered at the last refresh, without rendering or fetching anything."""
+    chart = chart_cache.get(station)
+    if chart is None:
+        await query.edit_message_text("The chart is not available yet, please try again in a few minutes.")
+        return
+    digest, png = chart
+    await query.edit_message_text(text=f"Chart: {station.replace('_', ' ').title()}", reply_markup=None)
+
+    photo_kwargs = dict(
+        chat_id=query.message.chat.id,
+        caption=f"Water level, rainfall and water flow of {station.replace('_', ' ').title()} with the forecast",
+        reply_to_message_id=query.message.message_id
+    )
+    # The same chart is uploaded once per refresh, afterwards its file_id is sent
+    file_id = image_cache.get(f"chart:{station}", digest)
+    if file_id:
+        try:
+            await context.bot.send_photo(photo=file_id, **photo_kwargs)
+            return
+        except BadRequest as e:
+            print(f"Cached chart of {station} rejected, uploading it again: {e}")
+            image_cache.discard(f"chart:{station}")
+    message = await context.bot.send_photo(photo=png, **photo_kwargs)
+    if message.photo:
+        image_cache.put(f"chart:{station}", digest, message.photo[-1].file_id)
+
 async def subscription_station_selection(query, is_unsubscribe: bool = False) -> None:
     """Prompt the user to select a station for subscription or unsubscription.""" 
-    keyboard = [[InlineKeyboardButton(station, callback_data=f"location_{station.replace(' ', '_')}")] for station in fetch_metadata()]
+    keyboard = [[InlineKeyboardButton(station, callback_data=f"location_{station_key(station)}")] for station in await fetch_metadata()]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     action = "subscribe to" if not is_unsubscribe else "unsubscribe from"
@@ -121,17 +248,17 @@ async def manage_subscription(query, context: ContextTypes.DEFAULT_TYPE, locatio
     chat_id = query.message.chat.id
 
     # Check if the user is unsubscribing or subscribing based on the presence of subscription data
-    is_unsubscribe = user_manager.is_user_subscribed(user_id, location)
+    is_unsubscribe = await user_manager.is_user_subscribed(user_id, location)
 
     if is_unsubscribe:
         # Unsubscribe the user from the selected location
-        user_manager.unsubscribe_user(user_id, location)
+        await user_manager.unsubscribe_user(user_id, location)
         await query.edit_message_text(
             text=f"You have been unsubscribed from daily flood alerts for {location.replace('_', ' ').title()}."
         )
     else:
         # Subscribe the user to the selected location
-        user_manager.subscribe_user(user_id, location)
+        await user_manager.subscribe_user(user_id, location)
         await query.edit_message_text(
             text=f"You have successfully subscribed to daily flood alerts for {location.replace('_', ' ').title()}."
         )
@@ -139,90 +266,410 @@ async def manage_subscription(query, context: ContextTypes.DEFAULT_TYPE, locatio
 async def new_session(query, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Start a new chat session""" 
     context.chat_data["system_prompt"] = FIXED_SYSTEM_PROMPT
-    context.chat_data["conversation_id"] = chatbot.new_conversation(modelIndex=DEFAULT_MODEL_INDEX, system_prompt=FIXED_SYSTEM_PROMPT)
+    await conversations.reset(query.message.chat.id)
     await query.message.reply_text("New chat session started!")
 
 async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle messages""" 
-    if "conversation_id" not in context.chat_data:
-        context.chat_data["system_prompt"] = FIXED_SYSTEM_PROMPT
-        context.chat_data["conversation_id"] = chatbot.new_conversation(modelIndex=DEFAULT_MODEL_INDEX, system_prompt=FIXED_SYSTEM_PROMPT)
+    context.chat_data.setdefault("system_prompt", FIXED_SYSTEM_PROMPT)
 
     init_msg = await update.message.reply_text("Generating response...")
 
-    conversation_id = context.chat_data["conversation_id"]
-    chatbot.change_conversation(conversation_id)
-
     message = update.message.text
     if not message:
         return
 
-    full_output_message = ""
+    # Coalesce the streamed chunks into a few throttled edits
+    editor = StreamingEditor(init_msg)
 
-    await update.message.chat.send_action(ChatAction.TYPING)
-    for message in generate_response(message, context_data):
-        if message:
-            full_output_message += message
-            send_message = format_message(full_output_message)
-            init_msg = await init_msg.edit_text(send_message, parse_mode=ParseMode.HTML, disable_web_page_preview=True)
+    # Only opening questions stand on their own, later ones may refer to earlier turns
+    chat_id = update.effective_chat.id
+    first_turn = conversations.first_turn(chat_id)
 
-async def broadcast_daily(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Send a daily broadcast message to all subscribed users for each station they are subscribed to."""
-    subscribed_users = user_manager.get_subscribed_users()  # Get all users and their subscribed stations
-    print(subscribed_users)
-    
-    for user_id, user_data in subscribed_users.items():
-        chat_id = user_data['chat_id']
-        
-        for station in user_data['stations']:  # Loop through each station the user is subscribed to
-            message = (
-                f"🌊 **Daily Flood Report for {station}**\n\n"
-                "Stay safe and updated on the current situation!\n\n"
-                f"**Location**: {station}\n"
-                f"**Water Level**: {context_data['water_level_info']}\n"
-                f"**Rainfall**: {context_data['rainfall_info']}\n"
-                f"**Waterflow**: {context_data['water_flow_info']}\n\n"
-                "**Forecast**\n"
-                f"Predicted Water Level: {predict_water_level()} meters\n\n"
-                "Stay alert and take precautions if needed! 🚨"
-            )
-            
-            try:
-                await context.bot.send_message(chat_id=chat_id, text=message)
-            except Exception as e:
-                print(f"Error sending message to {chat_id}: {e}")
+    cached = answer_cache.get(message) if first_turn else None
+    if cached is not None:
+        await editor.feed(cached)
+        await editor.flush()
+        # The conversation never saw this exchange, it goes along with the chat's next prompt
+        conversations.carry(chat_id, message, cached)
+        return
 
+    # The session is bound to the worker that owns its conversation, no shared client to switch
+    session = await conversations.acquire(chat_id)
 
-async def fetch_data(context: ContextTypes.DEFAULT_TYPE) -> None:
-    global context_data
+    # Snapshots refreshed while the answer is generated make it stale, see AnswerCache.put
+    version = answer_cache.version
+    await update.message.chat.send_action(ChatAction.TYPING)
+    async for chunk in generate_response(message, llm_context, session, earlier=conversations.take_carried(chat_id)):
+        if chunk:
+            await editor.feed(chunk)
+    await editor.flush()
+    if first_turn:
+        answer_cache.put(message, editor.formatter.text, version)
+
+async def warm_conversations(_: ContextTypes.DEFAULT_TYPE) -> None:
+    """Create the spare conversations so first messages don't wait for one."""
+    conversations.warm()
+
+async def prune_conversations(_: ContextTypes.DEFAULT_TYPE) -> None:
+    """Evict conversations of chats that have gone quiet."""
+    conversations.prune()
+
+def describe_age(seconds: float) -> str:
+    for unit, size in (("day", 86400), ("hour", 3600), ("minute", 60)):
+        if seconds >= size:
+            count = int(seconds // size)
+            return f"{count} {unit}{'s' if count > 1 else ''}"
+    return "less than a minute"
+
+def stale_note(key: str):
+    """Return a note with the age of a station's snapshot if it is stale, else None.
+
+    The snapshot is as old as its oldest field. The note is shown once it is older
+    than SNAPSHOT_STALE_AFTER, or right away while it holds last good values a
+    circuit breaker served in place of a failing source.
+    """
+    times = snapshot_times.get(key)
+    if not times:
+        return None
+    age = time.time() - min(times.values())
+    if context_data.get(key, {}).get("stale"):
+        return f"Some sources are unavailable, showing data last updated {describe_age(age)} ago."
+    if age < SNAPSHOT_STALE_AFTER:
+        return None
+    return f"Data last updated {describe_age(age)} ago."
+
+def save_snapshot() -> None:
+    """Write the snapshots and their refresh times to SNAPSHOT_PATH atomically."""
+    payload = {
+        key: {"updated_at": snapshot_times.get(key), "snapshot": snapshot}
+        for key, snapshot in context_data.items()
+    }
+    write_atomic(SNAPSHOT_PATH, json.dumps(payload, default=str))
 
-    
+def load_snapshot() -> None:
+    """Load the snapshots saved by the last run, keeping their original refresh times."""
     try:
-        forecast_data = predict_water_level(forward_days=5)
-    except (KeyError, IndexError, TypeError):
-        forecast_data = None
+        with open(SNAPSHOT_PATH, encoding="utf-8") as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        return
+    for key, entry in stored.items():
+        context_data.setdefault(key, entry["snapshot"])
+        updated_at = entry.get("updated_at") or {}
+        if isinstance(updated_at, (int, float)):
+            # Saved before the fields were timed separately
+            updated_at = dict.fromkeys(SNAPSHOT_FIELDS, updated_at)
+        snapshot_times.setdefault(key, updated_at)
+    print(f"Loaded snapshots of {', '.join(stored)} from {SNAPSHOT_PATH}")
+
+def _rebuild_context(stations) -> dict:
+    """Recompute the analytics and the LLM summary, returning the forecast of each station."""
+    global llm_context
+    analytics.refresh(series_window, [(station, measurement) for station in stations for measurement in MEASUREMENTS])
+    forecasts = {
+        station: context_data[station_key(station)]["water_level_forecast"]
+        for station in stations if station_key(station) in context_data
+    }
+    notes = [f"{station}: {note}" for station in forecasts if (note := stale_note(station_key(station)))]
+    llm_context = "\n".join(notes + [build_context(forecasts, analytics.get, MEASUREMENTS)])
+    return forecasts
+
+async def restore_state() -> None:
+    """Serve the last run's data right after a restart, the refresh job updates it in the background."""
+    await asyncio.to_thread(load_snapshot)
+    await seed_series_window()
+    _rebuild_context(await fetch_metadata())
+
+async def seed_series_window() -> None:
+    """Fill the rolling window from the local store, so the first refresh only fetches what is missing."""
+    since = time.time() - series_window.window_seconds
+    for station in await fetch_metadata():
+        for measurement in MEASUREMENTS:
+            if series_window.last_time(station, measurement) is None:
+                series_window.merge(station, measurement, await series_store.points(station, measurement, since))
+
+async def history(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Reply with the daily water levels of a station: /history [station] [days]"""
+    stations = await fetch_metadata()
+    args = list(context.args or [])
+    station = args.pop(0) if args and not args[0].isdigit() else stations[0]
+    days = min(int(args[0]), 365) if args and args[0].isdigit() else 14
+    if station not in stations:
+        await update.message.reply_text(f"Unknown station, choose one of: {', '.join(stations)}")
+        return
 
-    try:
-        water_level = fetch_measurement(station="bassac", range="15d", measurement="water_level")['data'][-1]
-    except (KeyError, IndexError, TypeError):
-        water_level = None
+    rows = await series_store.buckets("daily", station, "water_level", time.time() - days * 86400)
+    if not rows:
+        await update.message.reply_text(f"No history stored for {station.replace('_', ' ').title()} yet.")
+        return
+    lines = [
+        f"{datetime.fromtimestamp(bucket, timezone('UTC')):%d %b}: {mean:.2f} m ({low:.2f} - {high:.2f})"
+        for bucket, mean, low, high in rows
+    ]
+    await update.message.reply_text(
+        f"Daily water level at {station.replace('_', ' ').title()}, mean (min - max):\n\n" + "\n".join(lines)
+    )
 
-    try:
-        rainfall = fetch_measurement(station="bassac", range="15d", measurement="rainfall")['data'][-1]
-    except (KeyError, IndexError, TypeError):
-        rainfall = None
+def render_daily_report(station: str, snapshot: dict) -> str:
+    """Build the daily flood report of a station from its snapshot."""
+    return (
+        f"🌊 **Daily Flood Report for {station}**\n\n"
+        "Stay safe and updated on the current situation!\n\n"
+        f"**Location**: {station}\n"
+        f"**Water Level**: {snapshot['water_level_info']}\n"
+        f"**Rainfall**: {snapshot['rainfall_info']}\n"
+        f"**Waterflow**: {snapshot['water_flow_info']}\n\n"
+        "**Forecast**\n"
+        f"Predicted Water Level: {snapshot['water_level_forecast']} meters\n\n"
+        "Stay alert and take precautions if needed! 🚨"
+    )
 
-    try:
-        water_flow = fetch_measurement(station="bassac", range="15d", measurement="water_flow")['data'][-1]
-    except (KeyError, IndexError, TypeError):
-        water_flow = None
 
-    context_data = {
+def render_daily_reports(stations) -> dict:
+    """Render the report of every station once.
+
+    The forecast comes from the snapshot fetch_data keeps refreshed (and restored
+    after a restart), so the broadcast makes no upstream calls.
+    """
+    reports = {}
+    for station in stations:
+        if station not in context_data:
+            continue
+        report = render_daily_report(station, context_data[station])
+        note = stale_note(station)
+        reports[station] = f"{report}\n\n⏱️ {note}" if note else report
+    return reports
+
+
+def subscriber_batches(messages: dict):
+    """Return a BroadcastEngine.run_batches generator sending each station's message to its subscribers.
+
+    Subscribers are walked through the station index one page at a time, the
+    cursor is the station's position in `messages` and the last user_id sent to.
+    """
+    stations = list(messages)
+
+    async def batches(cursor):
+        start, after_user_id = cursor or (0, -1)
+        for index in range(start, len(stations)):
+            station = stations[index]
+            async for rows in user_manager.iter_subscribers(station, after_user_id=after_user_id):
+                yield [index, after_user_id], {chat_id: [messages[station]] for _, chat_id in rows}
+                after_user_id = rows[-1][0]
+            after_user_id = -1
+
+    return batches
+
+
+def daily_broadcast_id() -> str:
+    """One id per day, so a restart during the broadcast resumes it instead of starting over."""
+    return f"daily-{datetime.now(BROADCAST_TZ).date().isoformat()}"
+
+
+async def resume_broadcast(job_queue) -> None:
+    """Finish today's daily broadcast if the bot stopped while it was being sent."""
+    if BroadcastEngine(None, bucket=send_bucket).unfinished(daily_broadcast_id()):
+        print(f"Resuming the unfinished broadcast {daily_broadcast_id()}")
+        job_queue.run_once(broadcast_daily, when=0)
+
+
+async def broadcast_daily(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Send a daily broadcast message to all subscribed users for each station they are subscribed to."""
+    stations = [station_key(station) for station in await fetch_metadata()]
+    reports = render_daily_reports(stations)
+    for station in stations:
+        if station not in reports:
+            print(f"No data for {station}, skipping its daily report")
+    # Legacy names are re-keyed by a migration (LEGACY_STATION_KEYS), what is left matches no station
+    for station, count in (await user_manager.count_subscriptions()).items():
+        if station not in stations:
+            print(f"{count} subscription(s) to unknown station {station!r} get no daily report")
+
+    broadcast_id = daily_broadcast_id()
+    engine = BroadcastEngine(context.bot, bucket=send_bucket)
+    stats = await engine.run_batches(broadcast_id, subscriber_batches(reports))
+    print(f"Broadcast {broadcast_id} finished: {stats}")
+
+
+def _range_seconds(range: str) -> float:
+    """Convert a range such as "15d" or "300s" to seconds."""
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    return float(range[:-1]) * units[range[-1]]
+
+
+async def _gather_with_deadline(requests: dict, timeout: float) -> dict:
+    """Run the named coroutines concurrently and return whatever finished in time.
+
+    Requests that fail or miss the deadline are reported as None.
+    """
+    tasks = {name: asyncio.create_task(coro) for name, coro in requests.items()}
+    done, pending = await asyncio.wait(tasks.values(), timeout=timeout)
+    for task in pending:
+        task.cancel()
+
+    results = {}
+    for name, task in tasks.items():
+        if task in done and task.exception() is None:
+            results[name] = task.result()
+        else:
+            error = task.exception() if task in done else "deadline exceeded"
+            print(f"Error fetching {name}: {error}")
+            results[name] = None
+    return results
+
+
+async def _refresh_station(station: str):
+    """Fetch the forecast, the latest measurements and the latest image of one station.
+
+    Returns its snapshot, the points of each measurement that were not seen before
+    and the time each refreshed field was fetched. Fields whose request failed keep
+    their previous value and time. Stale values served by a circuit breaker mark
+    the snapshot stale and are dated back to when they were fetched.
+    """
+    ranges = {
+        measurement: series_window.fetch_range(station, measurement) if INCREMENTAL_FETCH else "15d"
+        for measurement in MEASUREMENTS
+    }
+
+    requests = {
+        "forecast": predict_water_level(forward_days=5, station=station),
+        "image": fetch_image_data(station=station, range=IMAGE_RANGE),
+    }
+    if INFLUX_BATCH:
+        # One request has to cover the series that is furthest behind
+        batch_range = max(ranges.values(), key=_range_seconds)
+        requests["measurements"] = fetch_measurements(station=station, range=batch_range, measurements=MEASUREMENTS)
+    else:
+        for measurement in MEASUREMENTS:
+            requests[measurement] = fetch_measurement(station=station, range=ranges[measurement], measurement=measurement)
+
+    results = await _gather_with_deadline(requests, REFRESH_DEADLINE)
+    if INFLUX_BATCH:
+        results.update(results.pop("measurements") or {})
+
+    previous = context_data.get(station_key(station), {})
+    now = time.time()
+    field_times = {}
+    latest = {}
+    new_points = {}
+    for measurement in MEASUREMENTS:
+        result = results.get(measurement)
+        try:
+            new_points[measurement] = series_window.merge(station, measurement, result['data'])
+        except (KeyError, TypeError):
+            pass
+        else:
+            since = stale_since(result)
+            field_times[f"{measurement}_info"] = now if since is None else since
+        # The window still holds the last good points when this request failed
+        latest[measurement] = series_window.latest(station, measurement)
+
+    # Image taps are answered from this record, a failed fetch keeps the previous one
+    image = latest_image(results["image"])
+    if image_url(image) is not None:
+        latest_images[station] = image
+
+    forecast_data = results["forecast"]
+    if not forecast_data or isinstance(forecast_data, str):
+        # predict_water_level answers with an error message when it fails
+        forecast_data = previous.get("water_level_forecast") or forecast_data
+    else:
+        since = stale_since(forecast_data)
+        field_times["water_level_forecast"] = now if since is None else since
+    water_level = latest["water_level"] or previous.get("water_level_info")
+    rainfall = latest["rainfall"] or previous.get("rainfall_info")
+    water_flow = latest["water_flow"] or previous.get("water_flow_info")
+
+    snapshot = {
         "water_level_forecast": forecast_data if forecast_data else "Forecast data is unavailable at the moment.",
         "water_level_info": water_level if water_level else "Water Level is unavailable at the moment.",
         "rainfall_info": rainfall if rainfall else "Rainfall data is unavailable at the moment.",
-        "water_flow_info": water_flow if water_flow else "Water Flow is unavailable at the moment."
+        "water_flow_info": water_flow if water_flow else "Water Flow is unavailable at the moment.",
+        "stale": any(at != now for at in field_times.values()),
+    }
+    return snapshot, new_points, field_times
+
+
+async def send_alerts(bot, alerts: dict) -> None:
+    """Send each station's alert to its subscribers right away."""
+    messages = {station: format_message(alert) for station, alert in alerts.items()}
+    # Raised alerts are recorded before sending, so there is nothing to resume after a restart
+    engine = BroadcastEngine(bot, checkpoint_path=None, bucket=send_bucket)
+    stats = await engine.run_batches(
+        f"alert-{datetime.now(BROADCAST_TZ).isoformat()}", subscriber_batches(messages), parse_mode=ParseMode.HTML
+    )
+    print(f"Alerts for {', '.join(alerts)} sent: {stats}")
+
+
+async def fetch_data(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Refresh the snapshot of every station returned by fetch_metadata."""
+    stations = await fetch_metadata()
+    semaphore = asyncio.Semaphore(REFRESH_CONCURRENCY)
+
+    async def refresh(station):
+        async with semaphore:
+            return await _refresh_station(station)
+
+    results = await asyncio.gather(*(refresh(station) for station in stations), return_exceptions=True)
+    changed = False
+    refreshed = False
+    new_points = {}
+    for station, result in zip(stations, results):
+        if isinstance(result, Exception):
+            print(f"Error refreshing {station}: {result}")
+            continue
+        snapshot, new_points[station], field_times = result
+        changed = changed or context_data.get(station_key(station)) != snapshot
+        context_data[station_key(station)] = snapshot
+        if field_times:
+            # Fields that got nothing keep the time of the value they still show
+            snapshot_times.setdefault(station_key(station), {}).update(field_times)
+            refreshed = True
+    if changed:
+        answer_cache.invalidate()
+
+    try:
+        await series_store.add({
+            (station, measurement): points
+            for station, by_measurement in new_points.items()
+            for measurement, points in by_measurement.items() if points
+        })
+    except Exception as e:
+        print(f"Error storing the new points: {e}")
+
+    forecasts = _rebuild_context(stations)
+
+    # Render the charts in the process pool without holding up this refresh
+    charts = {
+        station: (
+            {measurement: analytics.arrays(station, measurement) for measurement in MEASUREMENTS
+             if analytics.arrays(station, measurement) is not None},
+            [(at.timestamp(), value) for at, value in forecast_values(forecast)],
+            analytics.thresholds(station, "water_level"),
+        )
+        for station, forecast in forecasts.items()
     }
+    if charts:
+        context.application.create_task(chart_cache.refresh(charts))
+
+    # Only points that arrived in this cycle are checked, each alert goes out once
+    alerts = {}
+    for station, points in new_points.items():
+        lines = [line for measurement in MEASUREMENTS for line in alert_engine.evaluate(station, measurement, points.get(measurement))]
+        if lines:
+            alerts[station_key(station)] = alert_engine.render(station, lines)
+    if alerts:
+        await asyncio.to_thread(alert_engine.save)
+        context.application.create_task(send_alerts(context.bot, alerts))
+
+    if series_window.path:
+        await asyncio.to_thread(write_atomic, series_window.path, series_window.dumps())
+    # A cycle that refreshed no field would only overwrite the saved snapshots with the same values
+    if refreshed:
+        try:
+            await asyncio.to_thread(save_snapshot)
+        except OSError as e:
+            print(f"Error saving the snapshots: {e}")
 
     print(context_data)
-    
\ No newline at end of file
@@ -1,5 +1,17 @@
 import re
 
+# Patterns are compiled once, formatting runs on every streamed chunk
+_HAND_POINT_PATTERN = re.compile(r"(?<=\n)\*\s(?!\*)|^\*\s(?!\*)")
+_BOLD_PATTERN = re.compile(r"\*\*(.*?)\*\*")
+_ITALIC_PATTERN = re.compile(r"(?<!\*)\*(?!\*)(?!\*\*)(.*?)(?<!\*)\*(?!\*)")
+_CODE_PATTERN = re.compile(r"```([\w]*?)\n([\s\S]*?)```", flags=re.DOTALL)
+_CODE_OPEN_PATTERN = re.compile(r"```[\w]*?\n")
+_MONOSPACE_PATTERN = re.compile(r"(?<!`)`(?!`)(.*?)(?<!`)`(?!`)")
+_LINK_PATTERN = re.compile(r"\[(.*?)\]\((.*?)\)")
+_UNDERLINE_PATTERN = re.compile(r"__(.*?)__")
+_STRIKETHROUGH_PATTERN = re.compile(r"~~(.*?)~~")
+_HEADER_PATTERN = re.compile(r"^(#{1,6})\s+(.*)", flags=re.DOTALL)
+
 
 def escape_html(text: str) -> str:
     """Escapes HTML special characters in a string.
@@ -28,9 +40,7 @@ def apply_hand_points(text: str) -> str:
     Returns:
     str: The text with markdown bullet points replaced with emoji.
     """
-    pattern = r"(?<=\n)\*\s(?!\*)|^\*\s(?!\*)"
-
-    replaced_text = re.sub(pattern, "👉 ", text)
+    replaced_text = _HAND_POINT_PATTERN.sub("👉 ", text)
 
     return replaced_text
 
@@ -44,8 +54,7 @@ def apply_bold(text: str) -> str:
     Returns:
     str: The text with markdown bold replaced by HTML tags.
     """
-    pattern = r"\*\*(.*?)\*\*"
-    replaced_text = re.sub(pattern, r"<b>\1</b>", text)
+    replaced_text = _BOLD_PATTERN.sub(r"<b>\1</b>", text)
     return replaced_text
 
 
@@ -58,8 +67,7 @@ def apply_italic(text: str) -> str:
     Returns:
     str: The text with markdown italic replaced by HTML tags.
     """
-    pattern = r"(?<!\*)\*(?!\*)(?!\*\*)(.*?)(?<!\*)\*(?!\*)"
-    replaced_text = re.sub(pattern, r"<i>\1</i>", text)
+    replaced_text = _ITALIC_PATTERN.sub(r"<i>\1</i>", text)
     return replaced_text
 
 
@@ -72,8 +80,7 @@ def apply_code(text: str) -> str:
     Returns:
     str: The text with markdown code blocks replaced by HTML tags.
     """
-    pattern = r"```([\w]*?)\n([\s\S]*?)```"
-    replaced_text = re.sub(pattern, r"<pre lang='\1'>\2</pre>", text, flags=re.DOTALL)
+    replaced_text = _CODE_PATTERN.sub(r"<pre lang='\1'>\2</pre>", text)
     return replaced_text
 
 
@@ -86,8 +93,7 @@ def apply_monospace(text: str) -> str:
     Returns:
     str: The text with monospace sections replaced with HTML tags.
     """
-    pattern = r"(?<!`)`(?!`)(.*?)(?<!`)`(?!`)"
-    replaced_text = re.sub(pattern, r"<code>\1</code>", text)
+    replaced_text = _MONOSPACE_PATTERN.sub(r"<code>\1</code>", text)
     return replaced_text
 
 
@@ -100,8 +106,7 @@ def apply_link(text: str) -> str:
     Returns:
     str: The text with markdown links replaced by HTML anchor tags.
     """
-    pattern = r"\[(.*?)\]\((.*?)\)"
-    replaced_text = re.sub(pattern, r'<a href="\2">\1</a>', text)
+    replaced_text = _LINK_PATTERN.sub(r'<a href="\2">\1</a>', text)
     return replaced_text
 
 
@@ -113,8 +118,7 @@ def apply_underline(text: str) -> str:
 
     Returns:
     str: The text with markdown underlines replaced with HTML tags."""
-    pattern = r"__(.*?)__"
-    replaced_text = re.sub(pattern, r"<u>\1</u>", text)
+    replaced_text = _UNDERLINE_PATTERN.sub(r"<u>\1</u>", text)
     return replaced_text
 
 
@@ -127,8 +131,7 @@ def apply_strikethrough(text: str) -> str:
     Returns:
     str: The text with markdown strikethroughs replaced with HTML tags.
     """
-    pattern = r"~~(.*?)~~"
-    replaced_text = re.sub(pattern, r"<s>\1</s>", text)
+    replaced_text = _STRIKETHROUGH_PATTERN.sub(r"<s>\1</s>", text)
     return replaced_text
 
 
@@ -141,11 +144,34 @@ def apply_header(text: str) -> str:
     Returns:
     str: The text with markdown headers replaced with HTML tags.
     """
-    pattern = r"^(#{1,6})\s+(.*)"
-    replaced_text = re.sub(pattern, r"<b><u>\2</u></b>", text, flags=re.DOTALL)
+    replaced_text = _HEADER_PATTERN.sub(r"<b><u>\2</u></b>", text)
     return replaced_text
 
 
+def _format_line(line: str) -> str:
+    """Apply the inline formatting to a single non-code line.
+
+    Same result as running every apply_* function in turn, but a pattern
+    is only run when the characters it needs are present in the line.
+    """
+    if line.startswith("#"):
+        line = apply_header(line)
+    if "](" in line:
+        line = apply_link(line)
+    if "*" in line:
+        line = apply_bold(line)
+        line = apply_italic(line)
+    if "__" in line:
+        line = apply_underline(line)
+    if "~~" in line:
+        line = apply_strikethrough(line)
+    if "`" in line:
+        line = apply_monospace(line)
+    if line.startswith("*"):
+        line = apply_hand_points(line)
+    return line
+
+
 def apply_exclude_code(text: str) -> str:
     """Apply text formatting to non-code lines.
 
@@ -161,16 +187,7 @@ def apply_exclude_code(text: str) -> str:
             in_code_block = not in_code_block
 
         if not in_code_block:
-            formatted_line = lines[i]
-            formatted_line = apply_header(formatted_line)
-            formatted_line = apply_link(formatted_line)
-            formatted_line = apply_bold(formatted_line)
-            formatted_line = apply_italic(formatted_line)
-            formatted_line = apply_underline(formatted_line)
-            formatted_line = apply_strikethrough(formatted_line)
-            formatted_line = apply_monospace(formatted_line)
-            formatted_line = apply_hand_points(formatted_line)
-            lines[i] = formatted_line
+            lines[i] = _format_line(line)
 
     return "\n".join(lines)
 
@@ -190,4 +207,69 @@ def format_message(text: str) -> str:
     formatted_text = escape_html(text)
     formatted_text = apply_exclude_code(formatted_text)
     formatted_text = apply_code(formatted_text)
-    return formatted_text
\ No newline at end of file
+    return formatted_text
+
+
+class StreamingFormatter:
+    """Format a growing markdown text to HTML as it is streamed.
+
+    Completed lines are escaped and formatted once, in a single pass. They are
+    kept as rendered HTML once no code block is left open across them, so each
+    `feed` only re-renders the unfinished tail. `render()` is identical to
+    `format_message` applied to all the text fed so far.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._rendered = []  # HTML of the completed, self-contained parts
+        self._pending = []  # Formatted lines after the last completed part
+        self._in_code_block = False
+        self._line_start = 0  # Offset in `text` of the first line not processed yet
+
+    def feed(self, chunk: str) -> None:
+        """Add a chunk of text, formatting the lines it completes."""
+        self.text += chunk
+        end = self.text.rfind("\n")
+        if end >= self._line_start:
+            for line in self.text[self._line_start:end].split("\n"):
+                self._add_line(line)
+            self._line_start = end + 1
+
+    def _add_line(self, line: str) -> None:
+        line = escape_html(line)
+        if line.startswith("```"):
+            self._in_code_block = not self._in_code_block
+        if not self._in_code_block:
+            line = _format_line(line)
+
+        if "```" not in line:
+            if self._pending:
+                # Still inside an open code block, nothing can close it on this line
+                self._pending.append(line)
+            else:
+                self._rendered.append(line + "\n")
+            return
+
+        self._pending.append(line)
+        part = "\n".join(self._pending) + "\n"
+        if self._is_closed(part):
+            self._rendered.append(apply_code(part))
+            self._pending = []
+
+    @staticmethod
+    def _is_closed(part: str) -> bool:
+        """Check that no code block opened in `part` could be closed by later text."""
+        end = 0
+        for match in _CODE_PATTERN.finditer(part):
+            end = match.end()
+        return _CODE_OPEN_PATTERN.search(part, end) is None
+
+    def render(self) -> str:
+        """Return the HTML of everything fed so far."""
+        tail = escape_html(self.text[self._line_start:])
+        in_code_block = self._in_code_block
+        if tail.startswith("```"):
+            in_code_block = not in_code_block
+        if not in_code_block:
+            tail = _format_line(tail)
+        return "".join(self._rendered) + apply_code("\n".join(self._pending + [tail]))
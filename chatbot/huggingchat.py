@@ -1,24 +1,333 @@
+import asyncio
+import json
 import os
+import threading
+import time
 import requests
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from chatbot.queries import fetch_measurement, predict_water_level
+from chatbot.series import write_atomic
 from hugchat import hugchat
 from hugchat.login import Login
 from dotenv import load_dotenv
 
 load_dotenv(override=True)
 
-if os.getenv("HF_EMAIL") and os.getenv("HF_PASSWORD"):
-    sign = Login(os.getenv("HF_EMAIL"), os.getenv("HF_PASSWORD"))
-    cookies = sign.login()
-else:
-    cookies = requests.get("https://huggingface.co/chat/").cookies
+# Number of generations that can run at the same time, each worker has its own client
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", "4"))
 
-# Create a ChatBot
-chatbot = hugchat.ChatBot(cookies=cookies.get_dict())
+# Pre-warmed conversations, and how many idle ones are kept per bot
+LLM_SPARE_CONVERSATIONS = int(os.getenv("LLM_SPARE_CONVERSATIONS", "2"))
+LLM_MAX_CONVERSATIONS = int(os.getenv("LLM_MAX_CONVERSATIONS", "200"))
+LLM_CONVERSATION_TTL = float(os.getenv("LLM_CONVERSATION_TTL", "3600"))  # Seconds
 
+# Session cookies are cached here and reused across restarts until they expire
+HF_COOKIE_PATH = os.getenv("HF_COOKIE_PATH", "hf_cookies.json")
 
-def generate_response(message: str, context_data: str, station: str = "bassac", forecast_days: int = 5, time_range: str = "1d"):
-    """Generate a response to a message"""
+_DONE = object()
+_cookies = None
+_cookies_lock = threading.Lock()
+
+
+def _login():
+    """Log in to Hugging Face and return the session cookie jar."""
+    if os.getenv("HF_EMAIL") and os.getenv("HF_PASSWORD"):
+        sign = Login(os.getenv("HF_EMAIL"), os.getenv("HF_PASSWORD"))
+        return sign.login()
+    return requests.get("https://huggingface.co/chat/").cookies
+
+
+def _load_cookies():
+    """Return the cached cookies as a dict, or None if there are none or one has expired."""
+    try:
+        with open(HF_COOKIE_PATH, encoding="utf-8") as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        return None
+    now = time.time()
+    if not stored or any(cookie.get("expires") and cookie["expires"] <= now for cookie in stored):
+        return None
+    return {cookie["name"]: cookie["value"] for cookie in stored}
+
+
+def _save_cookies(jar) -> None:
+    stored = [
+        {"name": cookie.name, "value": cookie.value, "domain": cookie.domain, "expires": cookie.expires}
+        for cookie in jar
+    ]
+    try:
+        write_atomic(HF_COOKIE_PATH, json.dumps(stored))
+    except OSError as e:
+        print(f"Could not cache Hugging Face cookies: {e}")
+
+
+def get_cookies(refresh: bool = False) -> dict:
+    """Return the Hugging Face session cookies, logging in only when no valid cached ones exist.
+
+    Safe to call from several worker threads, only one of them logs in.
+    """
+    global _cookies
+    with _cookies_lock:
+        if _cookies is None or refresh:
+            cookies = None if refresh else _load_cookies()
+            if cookies is None:
+                jar = _login()
+                _save_cookies(jar)
+                cookies = jar.get_dict()
+            _cookies = cookies
+        return _cookies
+
+
+class ChatWorker:
+    def __init__(self, index: int):
+        """A hugchat client owned by a single thread.
+
+        The client is only ever touched from the worker's thread, and conversations
+        stay bound to the worker that created them.
+        """
+        self.index = index
+        self.active = 0  # Jobs queued or running on this worker
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"hugchat-{index}")
+        self._client = None
+
+    def _get_client(self):
+        """Create the client on first use, logging in again if the cached cookies are rejected."""
+        if self._client is None:
+            try:
+                self._client = hugchat.ChatBot(cookies=get_cookies())
+            except Exception as e:
+                print(f"Hugging Face session rejected, logging in again: {e}")
+                self._client = hugchat.ChatBot(cookies=get_cookies(refresh=True))
+        return self._client
+
+    async def run(self, fn, *args):
+        """Run `fn(client, *args)` on the worker's thread."""
+        self.active += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, lambda: fn(self._get_client(), *args)
+            )
+        finally:
+            self.active -= 1
+
+    async def new_conversation(self, model_index: int, system_prompt: str):
+        return await self.run(
+            lambda client: client.new_conversation(modelIndex=model_index, system_prompt=system_prompt)
+        )
+
+    async def stream(self, conversation, prompt: str):
+        """Yield the tokens of a reply as the worker's thread receives them."""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        stop = threading.Event()
+
+        def produce(client):
+            for resp in client.chat(prompt, _stream_yield_all=True, conversation=conversation):
+                if stop.is_set():
+                    break
+                if resp and "token" in resp:
+                    loop.call_soon_threadsafe(queue.put_nowait, resp["token"])
+
+        def finished(job):
+            # Runs after every token posted by produce, so nothing is lost
+            if not job.cancelled() and job.exception() is not None:
+                queue.put_nowait(job.exception())
+            queue.put_nowait(_DONE)
+
+        job = asyncio.ensure_future(self.run(produce))
+        job.add_done_callback(finished)
+        try:
+            while True:
+                item = await queue.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # Let the worker's thread drop the rest of an abandoned reply
+            stop.set()
+
+
+class ChatSession:
+    def __init__(self, worker: ChatWorker, conversation):
+        """A conversation together with the worker whose client owns it."""
+        self.worker = worker
+        self.conversation = conversation
+        self.last_used = time.monotonic()
+        self.in_use = 0  # Replies currently being generated
+        self.turns = 0  # Prompts sent to the conversation
+        self.idle = asyncio.Event()  # Set while no reply is being generated
+        self.idle.set()
+
+    def begin(self) -> None:
+        self.in_use += 1
+        self.turns += 1
+        self.idle.clear()
+
+    def end(self) -> None:
+        self.in_use -= 1
+        self.last_used = time.monotonic()
+        if not self.in_use:
+            self.idle.set()
+
+
+class ChatPool:
+    def __init__(self, size: int = LLM_WORKERS):
+        """A bounded set of hugchat workers shared by all chats."""
+        self.workers = [ChatWorker(index) for index in range(size)]
+
+    def least_busy(self) -> ChatWorker:
+        return min(self.workers, key=lambda worker: worker.active)
+
+    async def new_session(self, model_index: int, system_prompt: str) -> ChatSession:
+        """Create a conversation on the least busy worker."""
+        worker = self.least_busy()
+        conversation = await worker.new_conversation(model_index, system_prompt)
+        return ChatSession(worker, conversation)
+
+
+class ConversationPool:
+    def __init__(self, chat_pool: ChatPool, model_index: int, system_prompt: str,
+                 spare: int = LLM_SPARE_CONVERSATIONS, max_sessions: int = LLM_MAX_CONVERSATIONS,
+                 idle_ttl: float = LLM_CONVERSATION_TTL):
+        """Hand out one conversation per chat from a set of pre-warmed ones.
+
+        Args:
+            chat_pool (ChatPool): Workers the conversations are created on.
+            model_index (int): Model used for new conversations.
+            system_prompt (str): System prompt of every conversation.
+            spare (int): Conversations kept ready for chats that don't have one yet.
+            max_sessions (int): Chats holding a conversation before the least recently used is evicted.
+            idle_ttl (float): Seconds of inactivity after which a chat's conversation is evicted.
+        """
+        self.chat_pool = chat_pool
+        self.model_index = model_index
+        self.system_prompt = system_prompt
+        self.spare = spare
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._sessions = OrderedDict()  # chat_id -> ChatSession, least recently used first
+        self._spare = deque()
+        self._assigning = {}  # chat_id -> task handing the chat its first conversation
+        # chat_id -> (monotonic time, question, answer) answered without the chat's conversation
+        self._carried = OrderedDict()
+        self._refilling = False
+        self._tasks = set()
+
+    def _background(self, coro) -> None:
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refill(self) -> None:
+        """Create conversations until `spare` of them are ready."""
+        if self._refilling:
+            return
+        self._refilling = True
+        try:
+            while len(self._spare) < self.spare:
+                self._spare.append(await self.chat_pool.new_session(self.model_index, self.system_prompt))
+        except Exception as e:
+            print(f"Error pre-warming conversations: {e}")
+        finally:
+            self._refilling = False
+
+    async def _delete(self, session: ChatSession) -> None:
+        # A reply still streaming keeps its conversation until it is done
+        await session.idle.wait()
+        try:
+            await session.worker.run(lambda client: client.delete_conversation(session.conversation))
+        except Exception as e:
+            print(f"Error deleting conversation: {e}")
+
+    def warm(self) -> None:
+        """Start creating the spare conversations in the background."""
+        self._background(self._refill())
+
+    async def _assign(self, chat_id) -> ChatSession:
+        """Give the chat a pre-warmed conversation, or a new one if none is ready."""
+        try:
+            if self._spare:
+                session = self._spare.popleft()
+            else:
+                session = await self.chat_pool.new_session(self.model_index, self.system_prompt)
+            self._sessions[chat_id] = session
+            self.warm()
+            return session
+        finally:
+            del self._assigning[chat_id]
+
+    async def acquire(self, chat_id) -> ChatSession:
+        """Return the chat's conversation, handing out a pre-warmed one on first use."""
+        session = self._sessions.get(chat_id)
+        if session is None:
+            # Messages arriving together before the chat has a conversation share one
+            task = self._assigning.get(chat_id)
+            if task is None:
+                task = self._assigning[chat_id] = asyncio.ensure_future(self._assign(chat_id))
+            session = await asyncio.shield(task)
+        self._sessions.move_to_end(chat_id)
+        session.last_used = time.monotonic()
+        self.prune()
+        return session
+
+    def first_turn(self, chat_id) -> bool:
+        """Return whether the chat's next message opens its conversation."""
+        session = self._sessions.get(chat_id)
+        return chat_id not in self._carried and (session is None or not session.turns)
+
+    def carry(self, chat_id, question: str, answer: str) -> None:
+        """Remember an exchange answered without the chat's conversation, see `take_carried`."""
+        self._carried[chat_id] = (time.monotonic(), question, answer)
+        self._carried.move_to_end(chat_id)
+
+    def take_carried(self, chat_id):
+        """Return and forget the (question, answer) the conversation hasn't seen yet, or None."""
+        carried = self._carried.pop(chat_id, None)
+        return carried[1:] if carried else None
+
+    async def reset(self, chat_id) -> ChatSession:
+        """Drop the chat's conversation and start a fresh one.
+
+        A reply still being generated in the old conversation finishes first,
+        the conversation is deleted afterwards.
+        """
+        self._carried.pop(chat_id, None)
+        session = self._sessions.pop(chat_id, None)
+        if session is not None:
+            self._background(self._delete(session))
+        return await self.acquire(chat_id)
+
+    def prune(self) -> None:
+        """Evict conversations over `max_sessions` or idle longer than `idle_ttl`, oldest first."""
+        now = time.monotonic()
+        for chat_id, session in list(self._sessions.items()):
+            over_capacity = len(self._sessions) > self.max_sessions
+            if not over_capacity and now - session.last_used < self.idle_ttl:
+                break
+            if session.in_use:
+                continue
+            del self._sessions[chat_id]
+            self._carried.pop(chat_id, None)
+            self._background(self._delete(session))
+        # Exchanges of chats that went quiet before asking anything else
+        while self._carried:
+            chat_id, (carried_at, _, _) = next(iter(self._carried.items()))
+            if len(self._carried) <= self.max_sessions and now - carried_at < self.idle_ttl:
+                break
+            del self._carried[chat_id]
+
+
+chat_pool = ChatPool()
+
+
+async def generate_response(message: str, context_data: str, session: ChatSession, station: str = "bassac", forecast_days: int = 5, time_range: str = "1d", earlier=None):
+    """Generate a response to a message
+
+    `earlier` is a (question, answer) exchange of the chat the conversation hasn't seen.
+    """
     response_queue = ""
 
 
@@ -28,15 +337,23 @@ def generate_response(message: str, context_data: str, station: str = "bassac",
 
     {context_data}
     """
-    
-    for resp in chatbot.chat(
-        f"{context} \n\n >>> User prompt: {message}",
-        _stream_yield_all=True
-    ):
-        if resp:
-            if "token" in resp:
-                response_queue += resp["token"]
-        if len(response_queue) > 100:
-            yield response_queue
-            response_queue = ""
-    yield response_queue
+    if earlier:
+        question, answer = earlier
+        context += f"""
+    >>> Earlier in this chat the user asked: {question}
+    >>> and was answered: {answer}
+    """
+
+    session.begin()
+    try:
+        async for token in session.worker.stream(
+            session.conversation,
+            f"{context} \n\n >>> User prompt: {message}"
+        ):
+            response_queue += token
+            if len(response_queue) > 100:
+                yield response_queue
+                response_queue = ""
+        yield response_queue
+    finally:
+        session.end()
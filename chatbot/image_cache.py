@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+
+from chatbot.series import point_time, write_atomic
+
+# Telegram file_ids of station images already uploaded, kept across restarts
+IMAGE_CACHE_PATH = os.getenv("IMAGE_CACHE_PATH", "image_cache.json")
+
+_URL_KEYS = ("url", "image_url", "image", "src", "_value")
+
+
+def latest_image(response):
+    """Return the newest image record of a fetch_image_data response, or None."""
+    records = response.get("data", response) if isinstance(response, dict) else response
+    if isinstance(records, dict):
+        return records
+    if not isinstance(records, list) or not records:
+        return None
+    timed = [record for record in records if point_time(record) is not None]
+    return max(timed, key=point_time) if timed else records[-1]
+
+
+def image_url(record):
+    """Return the URL of an image record, or None."""
+    if isinstance(record, str):
+        return record
+    if isinstance(record, dict):
+        return next((record[key] for key in _URL_KEYS if isinstance(record.get(key), str)), None)
+    return None
+
+
+def image_version(record) -> str:
+    """Identify an image by its timestamp, or by a hash of its record when it has none."""
+    time = point_time(record)
+    if time is not None:
+        return time.isoformat()
+    return hashlib.sha1(json.dumps(record, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ImageCache:
+    def __init__(self, path: str = IMAGE_CACHE_PATH):
+        """Remember the Telegram file_id of the current image of each station.
+
+        Only the newest version of a station's image is kept, an image with a
+        new timestamp or hash has to be uploaded once before it is reused.
+
+        Args:
+            path (str): JSON file the file_ids are persisted to, None to keep them in memory.
+        """
+        self.path = path
+        self._file_ids = {}  # station -> (version, file_id)
+        if path:
+            self.load()
+
+    def get(self, station: str, version: str):
+        """Return the file_id of this version of the station's image, or None."""
+        cached = self._file_ids.get(station)
+        return cached[1] if cached and cached[0] == version else None
+
+    def put(self, station: str, version: str, file_id: str) -> None:
+        self._file_ids[station] = (version, file_id)
+        self.save()
+
+    def discard(self, station: str) -> None:
+        """Forget a station's file_id, e.g. after Telegram rejected it."""
+        if self._file_ids.pop(station, None) is not None:
+            self.save()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                self._file_ids = {station: tuple(entry) for station, entry in json.load(f).items()}
+        except (OSError, ValueError, TypeError):
+            self._file_ids = {}
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        try:
+            write_atomic(self.path, json.dumps(self._file_ids))
+        except OSError as e:
+            print(f"Could not save the image cache: {e}")
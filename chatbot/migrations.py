@@ -0,0 +1,120 @@
+# Versioned schema migrations, the applied version is stored in PRAGMA user_version.
+# Pending migrations run at startup in a single transaction. Add new schema changes
+# as a new entry at the end of MIGRATIONS.
+
+# Station names subscriptions were saved under before they were keyed by the
+# fetch_metadata names, mapped to the station_key of the current name
+LEGACY_STATION_KEYS = {
+    "Phnom_Penh_(Bassac)": "bassac",
+}
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+
+
+def _create_tables(conn):
+    """Create users and subscriptions tables if they don't exist."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            first_name TEXT,
+            username TEXT,
+            chat_id INTEGER
+        )
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS subscriptions (
+            user_id INTEGER,
+            station TEXT,
+            PRIMARY KEY (user_id, station),
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
+        )
+    ''')
+
+
+def _add_users_is_subscribed(conn):
+    """Bring databases created by older code in line with the deployed schema."""
+    if 'is_subscribed' not in _columns(conn, 'users'):
+        conn.execute('ALTER TABLE users ADD COLUMN is_subscribed BOOLEAN DEFAULT 0')
+
+
+def _add_subscription_indexes(conn):
+    """Index subscriptions by station for broadcasts and subscription checks."""
+    conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_subscriptions_station
+        ON subscriptions (station, user_id)
+    ''')
+
+
+def _rekey_legacy_stations(conn):
+    """Move subscriptions saved under legacy station names to the current station keys."""
+    for legacy, key in LEGACY_STATION_KEYS.items():
+        # A user subscribed under both names keeps the subscription to the current one
+        conn.execute('UPDATE OR IGNORE subscriptions SET station = ? WHERE station = ?', (key, legacy))
+        conn.execute('DELETE FROM subscriptions WHERE station = ?', (legacy,))
+
+
+def _create_series_tables(conn):
+    """Create the raw, hourly and daily tiers of the time-series store."""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS points (
+            station TEXT,
+            measurement TEXT,
+            time INTEGER,
+            value REAL,
+            PRIMARY KEY (station, measurement, time)
+        ) WITHOUT ROWID
+    ''')
+    for tier in ('hourly', 'daily'):
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {tier} (
+                station TEXT,
+                measurement TEXT,
+                bucket INTEGER,
+                count INTEGER,
+                total REAL,
+                min REAL,
+                max REAL,
+                PRIMARY KEY (station, measurement, bucket)
+            ) WITHOUT ROWID
+        ''')
+
+
+# Ordered list of (version, migration), versions must keep increasing
+MIGRATIONS = [
+    (1, _create_tables),
+    (2, _add_users_is_subscribed),
+    (3, _add_subscription_indexes),
+    (4, _rekey_legacy_stations),
+]
+
+# Migrations of the time-series database, versioned separately
+SERIES_MIGRATIONS = [
+    (1, _create_series_tables),
+]
+
+
+def schema_version(conn) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, migrations=MIGRATIONS) -> int:
+    """Apply pending migrations in one transaction and return the resulting schema version."""
+    current = schema_version(conn)
+    pending = [(version, migration) for version, migration in migrations if version > current]
+    if not pending:
+        return current
+
+    conn.commit()  # Start from a clean state so BEGIN doesn't fail on an open transaction
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for version, migration in pending:
+            print(f"Applying database migration {version}: {migration.__doc__}")
+            migration(conn)
+        conn.execute(f'PRAGMA user_version = {pending[-1][0]}')
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return pending[-1][0]
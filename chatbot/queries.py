@@ -1,6 +1,9 @@
-import requests
+import asyncio
 from dotenv import load_dotenv
 import os
+from chatbot import http_client
+from chatbot.auth import TokenManager
+from chatbot.circuit import CircuitBreaker
 
 # Load environment variables from .env file
 load_dotenv(override=True)
@@ -11,26 +14,40 @@ TOKEN = os.getenv("TOKEN")
 REFRESH_TOKEN = os.getenv("REFRESH_TOKEN")
 TOKEN_REFRESH_URL = os.getenv("TOKEN_REFRESH_URL")
 
-def predict_water_level(forward_days=5):
+# Measurements published for every station
+MEASUREMENTS = ("water_level", "rainfall", "water_flow")
+# Ask the influx proxy for all measurements in a single request
+INFLUX_BATCH = os.getenv("INFLUX_BATCH", "false").lower() == "true"
+
+# One breaker per upstream endpoint, each keeps the last good response per request
+predict_breaker = CircuitBreaker("predict")
+influx_breaker = CircuitBreaker("influx")
+image_breaker = CircuitBreaker("image")
+
+async def _predict(params):
+    response = await http_client.get(PREDICT_API_URL, params=params)
+    if response.status_code != 200:
+        raise Exception(f"Error: {response.status_code} - {response.text}")
+    return response.json()
+
+async def predict_water_level(forward_days=5, station=None):
     """
     Predict water levels for a given number of forward days.
+
+    While the prediction API is failing the last good forecast is returned, marked stale.
     """
     # Define the request parameters
     params = {"forward": forward_days}
+    if station:
+        params["station"] = station
 
     try:
-        # Make a GET request to the prediction API with query parameters
-        response = requests.get(PREDICT_API_URL, params=params)
-
-        # Check the response status code
-        if response.status_code == 200:
-            return response.json()  # Return the JSON response
-        else:
-            return f"Error: {response.status_code} - {response.text}"
+        return await predict_breaker.call((station, forward_days), _predict, params)
     except Exception as e:
-        return f"An error occurred: {e}"
+        # Errors raised by _predict already carry their message
+        return str(e) if str(e).startswith("Error:") else f"An error occurred: {e}"
 
-def refresh_access_token(username, password):
+async def refresh_access_token(username, password):
     url = os.getenv('LOGIN_URL')  # Get the login URL from environment variable
 
     if not url:
@@ -53,9 +70,11 @@ def refresh_access_token(username, password):
         'client_id': None,  # Remove if not required
         'client_secret': None  # Remove if not required
     }
+    # Drop unset fields, the form encoder would otherwise send them as empty strings
+    data = {key: value for key, value in data.items() if value is not None}
     
     # Send the POST request
-    response = requests.post(url, headers=headers, data=data)
+    response = await http_client.post(url, headers=headers, data=data)
     
     # Check if the request was successful
     if response.status_code == 200:
@@ -68,35 +87,33 @@ def refresh_access_token(username, password):
         print(f"Error: {response.status_code} - {response.text}")
         return None
 
-def fetch_measurement(station="bassac", range="15d", measurement="water_level"):
-    url = os.getenv('INFLUX_URL')  # Get the influx URL from environment variable
-    token = os.getenv('TOKEN')  # Retrieve access token from environment variable
+async def _login_from_env():
+    """Log in with the credentials from the environment and return the access token."""
+    return await refresh_access_token(os.getenv('USERNAME'), os.getenv('PASSWORD'))
+
+# Shared access token, refreshed ahead of expiry and on 403
+token_manager = TokenManager(_login_from_env, token=TOKEN)
+
+async def _authorized_get(url, params):
+    """Send an authorized GET request, refreshing the access token once on a 403."""
+    token = await token_manager.get_token()
 
     headers = {
         'accept': 'application/json',
         'Authorization': f"Bearer {token}"
     }
-    
-    params = {
-        'station': station,
-        'range': range,
-        'measurement': measurement
-    }
-    
-    response = requests.get(url, headers=headers, params=params)
 
-    if response.status_code == 200:
-        return response.json()
-    elif response.status_code == 403: 
-        username = os.getenv('USERNAME')
-        password = os.getenv('PASSWORD')
+    response = await http_client.get(url, headers=headers, params=params)
 
-        # Try refreshing the token
-        token = refresh_access_token(username, password)
+    if response.status_code == 200:
+        return response.json()  # Return the JSON response
+    elif response.status_code == 403:  # Unauthorized, possibly token expired
+        # Try refreshing the token, shared with any concurrent request that was rejected too
+        token = await token_manager.refresh(rejected=token)
         
         if token:  # Check if we got a new token
             headers['Authorization'] = f"Bearer {token}"
-            response = requests.get(url, headers=headers, params=params)
+            response = await http_client.get(url, headers=headers, params=params)
             
             if response.status_code == 200:
                 return response.json()  # Return the new JSON response
@@ -107,46 +124,53 @@ def fetch_measurement(station="bassac", range="15d", measurement="water_level"):
     else:
         raise Exception(f"Error: {response.status_code}, {response.text}")
 
-def fetch_image_data(station="bassac", range="15d"):
-    url = os.getenv('IMAGE_URL')  # Get the image URL from environment variable
-    token = os.getenv('TOKEN')  # Retrieve access token from environment variable
-    
-    headers = {
-        'accept': 'application/json',
-        'Authorization': f"Bearer {token}"
+async def fetch_measurement(station="bassac", range="15d", measurement="water_level"):
+    url = os.getenv('INFLUX_URL')  # Get the influx URL from environment variable
+
+    params = {
+        'station': station,
+        'range': range,
+        'measurement': measurement
     }
-    
+
+    return await influx_breaker.call((station, measurement), _authorized_get, url, params)
+
+async def fetch_measurements(station="bassac", range="15d", measurements=MEASUREMENTS):
+    """
+    Fetch several measurements of a station in one batched request.
+
+    The measurement names are sent as a repeated `measurement` parameter and the
+    backend is expected to answer with `{"data": {measurement: [...]}}`. The result
+    is keyed by measurement, each value shaped like a `fetch_measurement` response.
+    """
+    url = os.getenv('INFLUX_URL')  # Get the influx URL from environment variable
+
+    params = {
+        'station': station,
+        'range': range,
+        'measurement': list(measurements)
+    }
+
+    response = await influx_breaker.call((station, tuple(measurements)), _authorized_get, url, params)
+    data = response['data']
+    if not isinstance(data, dict):
+        raise Exception("Error: backend does not support batched measurement requests")
+
+    # A last good response served by the breaker stays marked stale on every measurement
+    marker = {key: response[key] for key in ("stale", "fetched_at") if key in response}
+    return {measurement: {'data': data.get(measurement, []), **marker} for measurement in measurements}
+
+async def fetch_image_data(station="bassac", range="15d"):
+    url = os.getenv('IMAGE_URL')  # Get the image URL from environment variable
+
     params = {
         'station': station,
         'range': range
     }
-    
-    response = requests.get(url, headers=headers, params=params)
-    
-    if response.status_code == 200:
-        return response.json()  # Return the JSON response
-    elif response.status_code == 403:  # Unauthorized, possibly token expired
-        # Retrieve credentials from environment variables
-        username = os.getenv('USERNAME')
-        password = os.getenv('PASSWORD')
 
-        # Try refreshing the token
-        token = refresh_access_token(username, password)
-        
-        if token:  # Check if we got a new token
-            headers['Authorization'] = f"Bearer {token}"
-            response = requests.get(url, headers=headers, params=params)
-            
-            if response.status_code == 200:
-                return response.json()  # Return the new JSON response
-            else:
-                raise Exception(f"Error after refreshing token: {response.status_code}, {response.text}")
-        else:
-            raise Exception("Failed to refresh token.")
-    else:
-        raise Exception(f"Error: {response.status_code}, {response.text}")
+    return await image_breaker.call((station, range), _authorized_get, url, params)
 
-def fetch_metadata():
+async def fetch_metadata():
     """
     Mock function to fetch metadata. This can be expanded to call an API
     if metadata fetching from the API is required.
@@ -155,4 +179,4 @@ def fetch_metadata():
 
 if __name__ == "__main__":
     # Access the environment variables
-    print(fetch_measurement()['data'])
+    print(asyncio.run(fetch_measurement())['data'])
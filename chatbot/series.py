@@ -0,0 +1,170 @@
+import json
+import math
+import os
+import tempfile
+from datetime import datetime, timezone
+
+WINDOW_SECONDS = 15 * 24 * 3600
+FULL_RANGE = "15d"
+# Extra seconds requested before the last known point to absorb clock skew
+RANGE_OVERLAP = 60
+
+_TIME_KEYS = ("_time", "time", "timestamp", "date")
+_VALUE_KEYS = ("_value", "value", "water_level", "prediction", "predicted")
+
+
+def _parse_time(value):
+    """Parse an ISO string or a unix timestamp (seconds or milliseconds) into an aware datetime."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        seconds = value / 1000 if value > 1e11 else value
+        return datetime.fromtimestamp(seconds, tz=timezone.utc)
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+    return None
+
+
+def write_atomic(path: str, payload: str) -> None:
+    """Replace the file at `path` with `payload` without ever leaving it half written.
+
+    Every call writes its own temporary file, so concurrent writers can't replace
+    `path` with each other's unfinished one.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        # mkstemp creates the file readable by its owner only, keep the mode of the file it replaces
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o644)
+        with open(fd, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def point_time(point):
+    """Return the timestamp of a measurement point, or None if it has none."""
+    if isinstance(point, dict):
+        for key in _TIME_KEYS:
+            if key in point:
+                return _parse_time(point[key])
+        return None
+    if isinstance(point, (list, tuple)) and point:
+        return _parse_time(point[0])
+    return None
+
+
+def point_value(point):
+    """Return the numeric value of a measurement point, or None if it has none."""
+    if isinstance(point, dict):
+        value = next((point[key] for key in _VALUE_KEYS if key in point), None)
+    elif isinstance(point, (list, tuple)) and len(point) > 1:
+        value = point[1]
+    else:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class RollingWindow:
+    def __init__(self, window_seconds=WINDOW_SECONDS, path=None):
+        """Keep the last `window_seconds` of every station/measurement series.
+
+        Args:
+            window_seconds (int): Length of the window kept per series.
+            path (str): Optional JSON file the window is persisted to and loaded from.
+        """
+        self.window_seconds = window_seconds
+        self.path = path
+        self._series = {}  # (station, measurement) -> points in time order
+        self._last = {}  # (station, measurement) -> datetime of the newest point
+        if path:
+            self.load()
+
+    def series(self, station, measurement):
+        """Return the points currently held for a series, oldest first."""
+        return self._series.get((station, measurement), [])
+
+    def latest(self, station, measurement):
+        """Return the newest point of a series, or None."""
+        points = self.series(station, measurement)
+        return points[-1] if points else None
+
+    def last_time(self, station, measurement):
+        return self._last.get((station, measurement))
+
+    def fetch_range(self, station, measurement, now=None):
+        """Return the `range` to request so that only points after the last one seen come back."""
+        last = self.last_time(station, measurement)
+        if last is None:
+            return FULL_RANGE
+        now = now or datetime.now(timezone.utc)
+        seconds = (now - last).total_seconds() + RANGE_OVERLAP
+        if seconds >= self.window_seconds:
+            return FULL_RANGE
+        return f"{max(math.ceil(seconds), RANGE_OVERLAP)}s"
+
+    def merge(self, station, measurement, points):
+        """Add fetched points to a series and return the ones that were not seen before.
+
+        Points without a readable timestamp can't be merged, in that case the
+        series is replaced and the next fetch asks for the full range again.
+        """
+        key = (station, measurement)
+        points = list(points or [])
+        timed = [(point_time(point), point) for point in points]
+        if any(time is None for time, _ in timed):
+            self._series[key] = points
+            self._last.pop(key, None)
+            return points
+
+        last = self._last.get(key)
+        timed.sort(key=lambda item: item[0])
+        new = [(time, point) for time, point in timed if last is None or time > last]
+        if not new:
+            return []
+
+        if last is None:
+            # First timed fetch, forget anything stored without timestamps
+            self._series[key] = []
+        series = self._series.setdefault(key, [])
+        series.extend(point for _, point in new)
+        newest = new[-1][0]
+        self._last[key] = newest
+
+        # Drop points that fell out of the window
+        cutoff = newest.timestamp() - self.window_seconds
+        start = 0
+        while start < len(series) and point_time(series[start]).timestamp() < cutoff:
+            start += 1
+        if start:
+            del series[:start]
+        return [point for _, point in new]
+
+    def dumps(self) -> str:
+        return json.dumps({f"{station}|{measurement}": points for (station, measurement), points in self._series.items()})
+
+    def save(self) -> None:
+        """Write the window to `path` atomically."""
+        if not self.path:
+            return
+        write_atomic(self.path, self.dumps())
+
+    def load(self) -> None:
+        """Load the window from `path`, ignoring a missing or unreadable file."""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                stored = json.load(f)
+        except (OSError, ValueError):
+            return
+        for key, points in stored.items():
+            station, _, measurement = key.partition("|")
+            self.merge(station, measurement, points)
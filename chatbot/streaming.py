@@ -0,0 +1,93 @@
+import asyncio
+import os
+import time
+
+from telegram.constants import ParseMode
+from telegram.error import BadRequest, RetryAfter
+
+from chatbot.broadcast import retry_after_seconds
+from chatbot.html_format import StreamingFormatter
+
+# Minimum seconds between two edits of messages in the same chat
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "0.8"))
+
+# chat_id -> earliest monotonic time the next edit in that chat may happen
+_next_edit_at = {}
+
+
+class StreamingEditor:
+    def __init__(self, message, interval=STREAM_EDIT_INTERVAL, clock=time.monotonic):
+        """Stream a growing reply into `message` with as few edits as possible.
+
+        Chunks are accumulated and the message is edited at most once every
+        `interval` seconds per chat. `flush` sends the final text.
+
+        Args:
+            message: The telegram Message to edit.
+            interval (float): Minimum seconds between edits in the same chat.
+            clock: Monotonic clock, replaceable for simulations.
+        """
+        self.message = message
+        self.interval = interval
+        self.clock = clock
+        self.formatter = StreamingFormatter()
+        self.edits = 0
+        self._chat_id = message.chat_id
+        self._last_text = None
+        self._plain = False  # Set once Telegram rejected the final HTML
+
+    def _ready(self) -> bool:
+        return self.clock() >= _next_edit_at.get(self._chat_id, 0)
+
+    def _hold(self, seconds: float) -> None:
+        now = self.clock()
+        if len(_next_edit_at) > 10000:
+            # Forget chats whose slot has passed
+            for chat_id in [chat_id for chat_id, at in _next_edit_at.items() if at <= now]:
+                del _next_edit_at[chat_id]
+        _next_edit_at[self._chat_id] = max(_next_edit_at.get(self._chat_id, 0), now + seconds)
+
+    async def feed(self, chunk: str) -> None:
+        """Add a chunk of the reply, editing the message if the chat is due for an edit."""
+        self.formatter.feed(chunk)
+        if self._ready():
+            await self._edit()
+
+    async def flush(self) -> None:
+        """Edit the message with the complete reply, waiting for the chat's edit slot."""
+        while True:
+            wait = _next_edit_at.get(self._chat_id, 0) - self.clock()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if await self._edit(final=True):
+                return
+
+    async def _edit(self, final: bool = False) -> bool:
+        """Edit the message with the current text. Returns False if it has to be retried."""
+        if self._plain:
+            text, kwargs = self.formatter.text, {}
+        else:
+            text, kwargs = self.formatter.render(), {"parse_mode": ParseMode.HTML}
+        if not text.strip() or text == self._last_text:
+            return True
+        try:
+            self.message = await self.message.edit_text(text, disable_web_page_preview=True, **kwargs)
+        except RetryAfter as e:
+            self._hold(retry_after_seconds(e.retry_after))
+            return False
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                self._last_text = text
+            elif final and not self._plain:
+                # Formatting the model produced can't be parsed, flush retries it as plain text
+                self._plain = True
+                return False
+            elif final:
+                print(f"Could not edit the reply in chat {self._chat_id}: {e}")
+            # Intermediate edits of half-written markup are simply skipped
+            self._hold(self.interval)
+            return True
+        self._last_text = text
+        self.edits += 1
+        self._hold(self.interval)
+        return True
@@ -0,0 +1,130 @@
+import asyncio
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from chatbot.migrations import SERIES_MIGRATIONS, migrate
+from chatbot.series import point_time, point_value
+
+SERIES_DB_PATH = os.getenv("SERIES_DB_PATH", "series.db")
+
+# Seconds per bucket of each downsampled tier
+TIERS = {"hourly": 3600, "daily": 86400}
+# How long each tier is kept, in days
+RETENTION_DAYS = {
+    "points": int(os.getenv("SERIES_RAW_RETENTION_DAYS", "30")),
+    "hourly": int(os.getenv("SERIES_HOURLY_RETENTION_DAYS", "365")),
+}
+
+
+class SeriesStore:
+    def __init__(self, db_path=SERIES_DB_PATH):
+        """Local store of every fetched series, with hourly and daily rollups.
+
+        Like UserManager, all database work runs on one dedicated thread that
+        owns the connection. Raw points are kept for a month and hourly buckets
+        for a year, daily buckets are kept forever.
+
+        Args:
+            db_path (str): Path of the SQLite database file.
+        """
+        self.db_path = db_path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="series-db")
+        self._conn = None
+        self._executor.submit(self._init_sqlite).result()
+
+    def _init_sqlite(self):
+        self._conn = sqlite3.connect(self.db_path)
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = NORMAL')
+        self._conn.execute('PRAGMA busy_timeout = 5000')
+        migrate(self._conn, SERIES_MIGRATIONS)
+
+    async def _run(self, fn, *args):
+        """Run `fn` on the database thread and return its result."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _rollup(self, station, measurement, start, end):
+        """Recompute the hourly and daily buckets between `start` and `end` from the tier below."""
+        hour = TIERS["hourly"]
+        self._conn.execute('''
+            INSERT OR REPLACE INTO hourly (station, measurement, bucket, count, total, min, max)
+            SELECT station, measurement, time / ? * ?, COUNT(*), SUM(value), MIN(value), MAX(value)
+            FROM points
+            WHERE station = ? AND measurement = ? AND time >= ? AND time < ?
+            GROUP BY time / ?
+        ''', (hour, hour, station, measurement, start // hour * hour, end // hour * hour + hour, hour))
+        day = TIERS["daily"]
+        self._conn.execute('''
+            INSERT OR REPLACE INTO daily (station, measurement, bucket, count, total, min, max)
+            SELECT station, measurement, bucket / ? * ?, SUM(count), SUM(total), MIN(min), MAX(max)
+            FROM hourly
+            WHERE station = ? AND measurement = ? AND bucket >= ? AND bucket < ?
+            GROUP BY bucket / ?
+        ''', (day, day, station, measurement, start // day * day, end // day * day + day, day))
+
+    def _add(self, new_points):
+        now = int(time.time())
+        with self._conn:
+            for (station, measurement), points in new_points.items():
+                rows = [
+                    (station, measurement, int(point_time(point).timestamp()), point_value(point))
+                    for point in points
+                    if point_time(point) is not None and point_value(point) is not None
+                ]
+                if not rows:
+                    continue
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO points (station, measurement, time, value) VALUES (?, ?, ?, ?)', rows
+                )
+                times = [row[2] for row in rows]
+                self._rollup(station, measurement, min(times), max(times))
+                for tier, days in RETENTION_DAYS.items():
+                    column = 'time' if tier == 'points' else 'bucket'
+                    self._conn.execute(
+                        f'DELETE FROM {tier} WHERE station = ? AND measurement = ? AND {column} < ?',
+                        (station, measurement, now - days * 86400)
+                    )
+
+    async def add(self, new_points: dict):
+        """Store the points of each (station, measurement) in one transaction and update the rollups."""
+        await self._run(self._add, new_points)
+
+    def _points(self, station, measurement, since):
+        return self._conn.execute('''
+            SELECT time, value FROM points
+            WHERE station = ? AND measurement = ? AND time >= ?
+            ORDER BY time
+        ''', (station, measurement, since)).fetchall()
+
+    async def points(self, station, measurement, since: float):
+        """Return the raw points of a series since a unix time, shaped like fetch_measurement data."""
+        rows = await self._run(self._points, station, measurement, int(since))
+        return [
+            {"_time": datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat(), "_value": value}
+            for timestamp, value in rows
+        ]
+
+    def _buckets(self, tier, station, measurement, since):
+        return self._conn.execute(f'''
+            SELECT bucket, total / count, min, max FROM {tier}
+            WHERE station = ? AND measurement = ? AND bucket >= ?
+            ORDER BY bucket
+        ''', (station, measurement, since)).fetchall()
+
+    async def buckets(self, tier: str, station, measurement, since: float):
+        """Return (bucket start, mean, min, max) rows of the hourly or daily tier since a unix time."""
+        if tier not in TIERS:
+            raise ValueError(f"Unknown tier {tier}, expected one of {', '.join(TIERS)}")
+        return await self._run(self._buckets, tier, station, measurement, int(since))
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def close(self):
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
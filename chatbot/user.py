@@ -1,57 +1,106 @@
+import asyncio
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from chatbot.migrations import migrate
 
 class UserManager:
-    def __init__(self, db_path='database.db'):
-        """Initialize the UserManager with SQLite database."""
+    def __init__(self, db_path='database.db', commit_interval=0.5, commit_batch=100):
+        """Initialize the UserManager with SQLite database.
+
+        All database work runs on one dedicated thread that owns a long-lived
+        connection, the public methods are coroutines that hand work to it.
+
+        Args:
+            db_path (str): Path of the SQLite database file.
+            commit_interval (float): Seconds `save_user` writes may wait before being committed.
+            commit_batch (int): Number of pending `save_user` writes that forces a commit.
+        """
         self.db_path = db_path
-        self._init_sqlite()
+        self.commit_interval = commit_interval
+        self.commit_batch = commit_batch
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._conn = None
+        self._pending_writes = 0
+        self._commit_handle = None
+        self._flush_task = None  # Referenced until done, the loop only keeps weak references to tasks
+        # station -> {user_id: chat_id}, only for stations loaded so far. Only read and
+        # changed on the event loop thread, never from the database thread.
+        self._subscribers = {}
+        self._executor.submit(self._init_sqlite).result()
 
-    def _init_sqlite(self):
-        """Initialize SQLite database and create users and subscriptions tables if they don't exist."""
+    def _connect(self):
+        """Open the connection used by the database thread and tune it."""
         conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # Create users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                first_name TEXT,
-                username TEXT,
-                chat_id INTEGER
-            )
-        ''')
-
-        # Create subscriptions table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS subscriptions (
-                user_id INTEGER,
-                station TEXT,
-                PRIMARY KEY (user_id, station),
-                FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
-            )
-        ''')
-
-        conn.commit()
-        conn.close()
-
-    def save_user(self, user_id, first_name, username, chat_id):
-        """Save or update user info in the SQLite database."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+        conn.execute('PRAGMA journal_mode = WAL')  # Readers don't block the writer
+        conn.execute('PRAGMA synchronous = NORMAL')  # Safe with WAL, avoids an fsync per commit
+        conn.execute('PRAGMA busy_timeout = 5000')
+        conn.execute('PRAGMA cache_size = -8000')  # 8 MB page cache
+        conn.execute('PRAGMA temp_store = MEMORY')
+        return conn
+
+    def _init_sqlite(self):
+        """Open the database and bring its schema up to date."""
+        self._conn = self._connect()
+        migrate(self._conn)
+
+    async def _run(self, fn, *args):
+        """Run `fn` on the database thread and return its result."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _commit(self):
+        self._conn.commit()
+        self._pending_writes = 0
+
+    def _execute_write(self, query, params):
+        """Execute a write and commit it right away."""
+        self._conn.execute(query, params)
+        self._commit()
+
+    async def _flush(self):
+        if self._conn is not None:
+            await self._run(self._commit)
+
+    def _start_flush(self):
+        """Timer callback committing the batched `save_user` writes."""
+        self._commit_handle = None
+        self._flush_task = asyncio.get_running_loop().create_task(self._flush())
+
+    def _cache_chat_id(self, user_id, chat_id):
+        """Point every cached subscription of a user at `chat_id`."""
+        for subscribers in self._subscribers.values():
+            if user_id in subscribers:
+                subscribers[user_id] = chat_id
+
+    def _save_user(self, user_id, first_name, username, chat_id):
+        self._conn.execute('''
             INSERT OR REPLACE INTO users (user_id, first_name, username, chat_id)
             VALUES (?, ?, ?, ?)
         ''', (user_id, first_name, username, chat_id))
-        conn.commit()
-        conn.close()
+        self._pending_writes += 1
+        if self._pending_writes >= self.commit_batch:
+            self._commit()
+        return self._pending_writes
+
+    async def save_user(self, user_id, first_name, username, chat_id):
+        """Save or update user info in the SQLite database.
+
+        Writes are committed in batches, at the latest `commit_interval` seconds later.
+        Reads go through the same connection and see them immediately.
+        """
+        pending = await self._run(self._save_user, user_id, first_name, username, chat_id)
+        self._cache_chat_id(user_id, chat_id)
+        if pending and self._commit_handle is None:
+            self._commit_handle = asyncio.get_running_loop().call_later(self.commit_interval, self._start_flush)
 
-    def get_user(self, user_id):
+    def _get_user(self, user_id):
+        cursor = self._conn.execute(
+            'SELECT user_id, first_name, username, chat_id FROM users WHERE user_id = ?', (user_id,)
+        )
+        return cursor.fetchone()
+
+    async def get_user(self, user_id):
         """Retrieve a single user's data from the SQLite database."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users WHERE user_id = ?', (user_id,))
-        user = cursor.fetchone()
-        conn.close()
+        user = await self._run(self._get_user, user_id)
         if user:
             return {
                 'user_id': user[0],
@@ -61,13 +110,12 @@ class UserManager:
             }
         return None
 
-    def get_all_users(self):
+    def _get_all_users(self):
+        return self._conn.execute('SELECT user_id, first_name, username, chat_id FROM users').fetchall()
+
+    async def get_all_users(self):
         """Retrieve all users' data from the SQLite database."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM users')
-        users = cursor.fetchall()
-        conn.close()
+        users = await self._run(self._get_all_users)
 
         # Convert the list of tuples to a dictionary
         user_dict = {}
@@ -79,56 +127,96 @@ class UserManager:
             }
         return user_dict
 
-    def delete_user(self, user_id):
+    def _delete_user(self, user_id):
+        self._execute_write('DELETE FROM users WHERE user_id = ?', (user_id,))
+
+    async def delete_user(self, user_id):
         """Delete a user from the SQLite database by their user ID."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM users WHERE user_id = ?', (user_id,))
-        conn.commit()
-        conn.close()
+        await self._run(self._delete_user, user_id)
+        self._cache_chat_id(user_id, None)
 
-    def update_user_chat_id(self, user_id, new_chat_id):
-        """Update a user's chat_id in the SQLite database."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+    def _update_user_chat_id(self, user_id, new_chat_id):
+        self._execute_write('''
             UPDATE users
             SET chat_id = ?
             WHERE user_id = ?
         ''', (new_chat_id, user_id))
-        conn.commit()
-        conn.close()
 
-    def subscribe_user(self, user_id, station):
-        """Subscribe the user to a station."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+    async def update_user_chat_id(self, user_id, new_chat_id):
+        """Update a user's chat_id in the SQLite database."""
+        await self._run(self._update_user_chat_id, user_id, new_chat_id)
+        self._cache_chat_id(user_id, new_chat_id)
+
+    def _subscribe_user(self, user_id, station):
+        self._execute_write('''
             INSERT OR IGNORE INTO subscriptions (user_id, station)
             VALUES (?, ?)
         ''', (user_id, station))
-        conn.commit()
-        conn.close()
+        user = self._get_user(user_id)
+        return user[3] if user else None
+
+    async def subscribe_user(self, user_id, station):
+        """Subscribe the user to a station."""
+        chat_id = await self._run(self._subscribe_user, user_id, station)
+        subscribers = self._subscribers.get(station)
+        if subscribers is not None:
+            subscribers[user_id] = chat_id
 
-    def unsubscribe_user(self, user_id, station):
+    def _unsubscribe_user(self, user_id, station):
+        self._execute_write('DELETE FROM subscriptions WHERE user_id = ? AND station = ?', (user_id, station))
+
+    async def unsubscribe_user(self, user_id, station):
         """Unsubscribe the user from a station."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM subscriptions WHERE user_id = ? AND station = ?', (user_id, station))
-        conn.commit()
-        conn.close()
+        await self._run(self._unsubscribe_user, user_id, station)
+        subscribers = self._subscribers.get(station)
+        if subscribers is not None:
+            subscribers.pop(user_id, None)
 
-    def get_subscribed_users(self):
-        """Retrieve all subscribed users with their stations."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
+    def _load_subscribers(self, station):
+        """Read the subscribers of a station, user_id -> chat_id."""
+        cursor = self._conn.execute('''
+            SELECT s.user_id, u.chat_id
+            FROM subscriptions s
+            LEFT JOIN users u ON u.user_id = s.user_id
+            WHERE s.station = ?
+        ''', (station,))
+        return dict(cursor)
+
+    def _subscribers_page(self, station, after_user_id, limit):
+        return self._conn.execute('''
+            SELECT s.user_id, u.chat_id
+            FROM subscriptions s
+            JOIN users u ON u.user_id = s.user_id
+            WHERE s.station = ? AND s.user_id > ? AND u.chat_id IS NOT NULL
+            ORDER BY s.user_id
+            LIMIT ?
+        ''', (station, after_user_id, limit)).fetchall()
+
+    async def iter_subscribers(self, station, batch_size=500, after_user_id=-1):
+        """Yield the (user_id, chat_id) subscriptions of a station in batches of up to `batch_size`.
+
+        Batches are ordered by user_id and start after `after_user_id`, so a caller
+        can resume after the last user it handled. They are paged through the
+        station index, which is ordered by user_id already, so only one batch is
+        held in memory at a time.
+        """
+        while True:
+            rows = await self._run(self._subscribers_page, station, after_user_id, batch_size)
+            if not rows:
+                return
+            yield rows
+            after_user_id = rows[-1][0]
+
+    def _get_subscribed_users(self):
+        return self._conn.execute('''
             SELECT u.user_id, u.first_name, u.username, u.chat_id, s.station
             FROM users u
             JOIN subscriptions s ON u.user_id = s.user_id
-        ''')
-        users = cursor.fetchall()
-        conn.close()
+        ''').fetchall()
+
+    async def get_subscribed_users(self):
+        """Retrieve all subscribed users with their stations."""
+        users = await self._run(self._get_subscribed_users)
 
         # Structure data for easy access
         subscribed_users = {}
@@ -144,23 +232,42 @@ class UserManager:
             subscribed_users[user_id]['stations'].append(user[4])
         return subscribed_users
 
-    def get_user_stations(self, user_id):
+    def _count_subscriptions(self):
+        return self._conn.execute('SELECT station, COUNT(*) FROM subscriptions GROUP BY station').fetchall()
+
+    async def count_subscriptions(self):
+        """Return the number of subscriptions per station, as stored."""
+        return dict(await self._run(self._count_subscriptions))
+
+    def _get_user_stations(self, user_id):
+        return self._conn.execute('SELECT station FROM subscriptions WHERE user_id = ?', (user_id,)).fetchall()
+
+    async def get_user_stations(self, user_id):
         """Get all subscribed stations for a user."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT station FROM subscriptions WHERE user_id = ?', (user_id,))
-        stations = cursor.fetchall()
-        conn.close()
+        stations = await self._run(self._get_user_stations, user_id)
         return [station[0] for station in stations]
 
-    def is_user_subscribed(self, user_id, station):
+    async def is_user_subscribed(self, user_id, station):
         """Check if the user is subscribed to a specific station."""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            'SELECT 1 FROM subscriptions WHERE user_id = ? AND station = ?',
-            (user_id, station)
-        )
-        is_subscribed = cursor.fetchone() is not None  # True if subscription exists, else False
-        conn.close()
-        return is_subscribed
\ No newline at end of file
+        subscribers = self._subscribers.get(station)
+        if subscribers is None:
+            loaded = await self._run(self._load_subscribers, station)
+            # A concurrent call may have cached the station meanwhile, keep its copy
+            subscribers = self._subscribers.setdefault(station, loaded)
+        return user_id in subscribers
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.commit()
+            self._conn.close()
+            self._conn = None
+
+    async def close(self):
+        """Commit pending writes and close the connection."""
+        if self._commit_handle is not None:
+            self._commit_handle.cancel()
+            self._commit_handle = None
+        if self._flush_task is not None:
+            await self._flush_task
+        await self._run(self._close)
+        self._executor.shutdown(wait=True)
@@ -1,4 +1,5 @@
-from chatbot.bot import telegram_bot
-
 if __name__ == "__main__":
-    telegram_bot()
\ No newline at end of file
+    # Imported here so the chart worker processes, which re-import this module, don't start the bot's state
+    from chatbot.bot import telegram_bot
+
+    telegram_bot()